@@ -0,0 +1,82 @@
+#Import data library
+import warnings
+
+import numpy as np
+
+import calibration_fit as CF
+
+'''
+adaptive sweep refiner class
+Functionality:
+1) Starts a sweep on a coarse subset of the normal setpoint grid
+2) After each round finds the setpoints where the response is not linear enough between its
+   neighbours (local residual) or where the calibration_fit residuals of the inverters disagree
+   (spread), so a piecewise linear calibration from the sparse grid matches the full grid
+3) Inserts the grid setpoint closest to the middle of every interval next to a bad point,
+   until nothing is over tolerance, the grid is exhausted or max_rounds is reached
+'''
+
+class adaptive_refiner:
+    # config values
+    # Coarse grid takes every coarse_stride-th setpoint of the full grid (plus the last one)
+    coarse_stride = 10
+    max_rounds = 6
+
+    def __init__(self, grid, residual_tolerance, spread_tolerance, degree=1):
+        # grid is the full sweep, ex. kpsu.voltage_setpoints(), new setpoints are always taken from it
+        self.grid = sorted(grid)
+        self.residual_tolerance = residual_tolerance
+        self.spread_tolerance = spread_tolerance
+        self.fit = CF.calibration_fit(degree)
+        self.rounds = 0
+
+    def initial_points(self):
+        points = self.grid[::self.coarse_stride]
+        if points[-1] != self.grid[-1]:
+            points.append(self.grid[-1])
+        return points
+
+    def bad_points(self, setpoints, readings):
+        # Setpoints (sorted, measured rows only) where the sparse grid is not good enough
+        # Local residual: distance of every inner point from the line through its two neighbours
+        local = np.zeros(len(setpoints))
+        weight = (setpoints[1:-1] - setpoints[:-2]) / (setpoints[2:] - setpoints[:-2])
+        predicted = readings[:-2] + weight[:, np.newaxis] * (readings[2:] - readings[:-2])
+        # Spread: how much the inverters disagree about the per inverter fit residual
+        result = self.fit.fit(setpoints, readings)
+        with warnings.catch_warnings():
+            # Dead channels are all nan, that is not a disagreement between inverters
+            warnings.simplefilter('ignore', RuntimeWarning)
+            local[1:-1] = np.nan_to_num(np.nanmax(np.abs(readings[1:-1] - predicted), axis=1))
+            spread = np.nan_to_num(np.nanmax(result.residuals, axis=1) - np.nanmin(result.residuals, axis=1))
+        bad = (local > self.residual_tolerance) | (spread > self.spread_tolerance)
+        return set(np.round(setpoints[bad], 6).tolist())
+
+    def refine(self, setpoints, readings):
+        # Returns the setpoints to measure next round, empty when the sweep is done
+        self.rounds += 1
+        if self.rounds >= self.max_rounds:
+            return []
+        setpoints = np.asarray(setpoints, dtype=np.float64)
+        readings = np.asarray(readings, dtype=np.float64)
+        measured = ~np.isnan(setpoints) & ~np.all(np.isnan(readings), axis=1)
+        order = np.argsort(setpoints[measured])
+        setpoints = setpoints[measured][order]
+        readings = readings[measured][order]
+        # A line through two points always fits, wait for a third
+        if len(setpoints) < 3:
+            return []
+
+        bad = self.bad_points(setpoints, readings)
+        done = set(np.round(setpoints, 6).tolist())
+        ordered = sorted(done)
+        new_points = set()
+        for low, high in zip(ordered[:-1], ordered[1:]):
+            if low not in bad and high not in bad:
+                continue
+            # Grid setpoint closest to the middle of the interval that is not measured yet
+            inside = [s for s in self.grid if low < s < high and round(s, 6) not in done]
+            if inside:
+                middle = (low + high) / 2.0
+                new_points.add(min(inside, key=lambda s: abs(s - middle)))
+        return sorted(new_points)
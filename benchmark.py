@@ -0,0 +1,135 @@
+# Import other libraries
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import calibration_station as CS
+import step_profiler as SP
+import psu_simulator as PS
+import particle_simulator as PSIM
+
+'''
+benchmark
+Functionality:
+1) Runs full_voltage_sweep / full_current_sweep end to end against the simulated power supply
+   and the local particle cloud stand in, no hardware needed
+2) Delays and thermal time constants are scaled down by --scale so a run takes seconds
+3) Reports total and per step time, psu and cloud round trips and peak memory for each sweep
+
+python benchmark.py --scale 0.001 --inverters 8 --settle adaptive
+'''
+
+def build_station(args, supply, cloud, save_directory):
+    station = CS.calibration_station(name="benchmark", device_id="benchmark",
+                                     inverter_count=args.inverters, save_directory=save_directory)
+    kpsu = station.kpsu
+    kpsu.rm = PS.simulated_resource_manager(supply)
+    kpsu.load_switch = supply.connect_load
+    kpsu.settle_mode = args.settle
+    kpsu.batch_scpi = not args.no_batch
+    # Same plan as the bench, only faster
+    kpsu.v_delay = kpsu.v_delay * args.scale
+    kpsu.c_settle_delay = kpsu.c_settle_delay * args.scale
+    kpsu.settle_poll_interval = kpsu.settle_poll_interval * args.scale
+    station.thermal.time_constant = station.thermal.time_constant * args.scale
+    station.current_step_duration = station.current_step_duration * args.scale
+    station.sample_read_duration = station.sample_read_duration * args.scale
+    station.finish_delay = 0
+    station.pm.url = cloud.url
+    station.ingest_mode = args.ingest
+    station.samples_per_setpoint = args.samples
+    return station
+
+
+def run_sweep(station, sweep, supply, cloud, verbose):
+    step_times = []
+    last_step = [time.monotonic()]
+
+    def progress(name, sweep_name, done, total):
+        now = time.monotonic()
+        if done:
+            step_times.append(now - last_step[0])
+        last_step[0] = now
+
+    station.progress = progress
+    round_trips = supply.round_trips
+    requests = cloud.requests
+    tracemalloc.reset_peak()
+    start = time.monotonic()
+    with redirect_stdout(None if verbose else open(os.devnull, 'w')):
+        if sweep == 'volts':
+            station.full_voltage_sweep()
+        else:
+            station.full_current_sweep()
+    total = time.monotonic() - start
+    current, peak = tracemalloc.get_traced_memory()
+    steps = len(step_times)
+    return {
+        'sweep': sweep,
+        'steps': steps,
+        'total_s': total,
+        'step_mean_s': sum(step_times) / steps if steps else 0.0,
+        'step_p95_s': SP.percentile(step_times, 0.95),
+        'step_max_s': max(step_times) if step_times else 0.0,
+        'psu_round_trips': supply.round_trips - round_trips,
+        'psu_round_trips_per_step': (supply.round_trips - round_trips) / steps if steps else 0.0,
+        'cloud_requests': cloud.requests - requests,
+        'peak_memory_kb': peak / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the calibration sweeps against simulated hardware")
+    parser.add_argument('--scale', type=float, default=0.001, help="multiplier for all delays and time constants")
+    parser.add_argument('--inverters', type=int, default=3)
+    parser.add_argument('--psu-latency', type=float, default=0.002, help="seconds per SCPI round trip")
+    parser.add_argument('--cloud-latency', type=float, default=0.01, help="seconds per particle request")
+    parser.add_argument('--settle', choices=['fixed', 'adaptive'], default='fixed')
+    parser.add_argument('--no-batch', action='store_true', help="one SCPI round trip per command")
+    parser.add_argument('--ingest', choices=['poll', 'stream'], default='poll',
+                        help="poll the cloud functions or read the published event stream")
+    parser.add_argument('--samples', type=int, default=1, help="readings averaged per setpoint")
+    parser.add_argument('--sweep', choices=['volts', 'current', 'both'], default='both')
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--verbose', action='store_true', help="show the sweep output")
+    parser.add_argument('--profile', action='store_true', help="show the time per phase (SCPI, settle, HTTP ...)")
+    args = parser.parse_args()
+
+    supply = PS.simulated_power_supply()
+    supply.latency = args.psu_latency
+    cloud = PSIM.particle_simulator(supply, args.inverters)
+    cloud.latency = args.cloud_latency
+    cloud.start()
+    tracemalloc.start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as save_directory:
+            station = build_station(args, supply, cloud, save_directory)
+            sweeps = ['volts', 'current'] if args.sweep == 'both' else [args.sweep]
+            for sweep in sweeps:
+                results.append(run_sweep(station, sweep, supply, cloud, args.verbose))
+            profile = station.profiler.summary()
+    finally:
+        tracemalloc.stop()
+        cloud.stop()
+
+    for result in results:
+        print(f"{result['sweep']} sweep: {result['steps']} steps in {result['total_s']:.2f} s")
+        print(f"  per step mean {result['step_mean_s'] * 1000:.1f} ms, p95 {result['step_p95_s'] * 1000:.1f} ms, "
+              f"max {result['step_max_s'] * 1000:.1f} ms")
+        print(f"  psu round trips {result['psu_round_trips']} ({result['psu_round_trips_per_step']:.1f} per step), "
+              f"cloud requests {result['cloud_requests']}")
+        print(f"  peak memory {result['peak_memory_kb']:.0f} KB")
+    if args.profile:
+        station.profiler.report()
+    if args.json:
+        with open(args.json, mode='w') as file:
+            json.dump({'settings': vars(args), 'results': results, 'profile': profile}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Import other libraries
+import json
+import os
+
+import numpy as np
+import calibration_fit as CF
+
+'''
+calibration cache class
+Functionality:
+1) Keeps the fitted voltage and current coefficients of every inverter in one json file, keyed
+   by the inverter id the particle device reports (getInverterIds)
+2) A re-test only measures a few setpoints and compares them against the cached curve with
+   predict(), a full calibration is only needed when that is out of tolerance
+3) Entries older than max_age_days are treated as missing so every unit is fully recalibrated now and then
+'''
+
+def predict(sweep_entry, measured):
+    # Reference values the cached curve gives for one inverter's measurements
+    fit = CF.calibration_fit(sweep_entry['degree'], sweep_entry['breakpoints'])
+    measured = np.asarray(measured, dtype=np.float64)[:, np.newaxis]
+    return fit.apply(np.asarray([sweep_entry['coefficients']]), measured)[:, 0]
+
+
+class calibration_cache:
+    # config values
+    max_age_days = 180
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.entries = self.load()
+
+    def load(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+        with open(self.cache_file) as file:
+            return json.load(file)['inverters']
+
+    def save(self):
+        # Write to a temp file and swap it in so a crash never leaves a half written cache
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        temp_file = self.cache_file + ".tmp"
+        with open(temp_file, mode='w') as file:
+            json.dump({'format_version': 1, 'inverters': self.entries}, file, indent=2)
+        os.replace(temp_file, self.cache_file)
+        print(f"Calibration cache written to {self.cache_file}")
+
+    def get(self, inverter_id, now):
+        # Cached entry of the inverter, None when it was never calibrated or the entry expired
+        entry = self.entries.get(inverter_id)
+        if entry is None or now - entry['calibrated'] > self.max_age_days * 86400:
+            return None
+        return entry
+
+    def sweep_entry(self, fit, result, index):
+        return {'degree': fit.degree, 'breakpoints': fit.breakpoints, 'terms': result.term_names,
+                'coefficients': result.coefficients[index].tolist(),
+                'rms_error': float(result.rms_error[index]), 'max_error': float(result.max_error[index])}
+
+    def put(self, inverter_id, fit, voltage_result, current_result, index, now, run_dir=None, station=None):
+        # index is the column of the inverter in the fit results, returns False when it has no fit
+        if not (voltage_result.fitted[index] and current_result.fitted[index]):
+            print(f"{inverter_id} has no fit, calibration not cached")
+            return False
+        self.entries[inverter_id] = {
+            'calibrated': now,
+            'verified': now,
+            'run_dir': run_dir,
+            'station': station,
+            'voltage': self.sweep_entry(fit, voltage_result, index),
+            'current': self.sweep_entry(fit, current_result, index),
+        }
+        return True
+
+    def mark_verified(self, inverter_id, now):
+        self.entries[inverter_id]['verified'] = now
@@ -0,0 +1,127 @@
+#Import csv and data library
+import csv
+import os
+import warnings
+import numpy as np
+
+'''
+calibration fit class
+Functionality:
+1) Fits per inverter correction coefficients, reference = f(inverter measurement), from the
+   data_manager voltage and current matrices
+2) Solves every inverter column in one batched least squares pass, nan readings are skipped
+3) Supports gain/offset, extra polynomial terms and piecewise (hinge) terms at breakpoints
+4) Reports residuals and max error per inverter and writes a coefficient table ready to flash
+5) Inverters with fewer valid points than terms (dead channel, all nan) get nan coefficients and
+   fitted False, they are left out of the table, the calibration cache and the run database
+6) fit_run() fits both sweeps of a data_manager and writes the tables to its run directory
+'''
+
+class calibration_result:
+
+    def __init__(self, term_names, coefficients, residuals, points):
+        # coefficients is (inverter x term), residuals is (setpoint x inverter) with nan where skipped
+        self.term_names = term_names
+        self.coefficients = coefficients
+        self.residuals = residuals
+        self.points = points
+        # Inverters with too few points to solve every term, their coefficients are nan
+        self.fitted = points >= len(term_names)
+        self.offset = coefficients[:, 0]
+        self.gain = coefficients[:, 1]
+        with warnings.catch_warnings():
+            # Inverters without a single residual give mean of empty slice / all nan slice warnings
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.rms_error = np.sqrt(np.nanmean(residuals ** 2, axis=0))
+            self.max_error = np.nanmax(np.abs(residuals), axis=0)
+
+    def unfitted(self):
+        # Positions (0 based) of the inverters without a fit
+        return np.flatnonzero(~self.fitted).tolist()
+
+    def report(self, name):
+        print(f"{name} calibration fit ({', '.join(self.term_names)})")
+        for i in range(len(self.gain)):
+            if not self.fitted[i]:
+                print(f"Inverter {i + 1}: NOT FITTED, {self.points[i]} points for {len(self.term_names)} terms")
+                continue
+            print(f"Inverter {i + 1}: gain {self.gain[i]:.6f}, offset {self.offset[i]:.6f}, "
+                  f"rms {self.rms_error[i]:.6f}, max error {self.max_error[i]:.6f}, points {self.points[i]}")
+
+    def to_csv(self, csv_file):
+        header = ['Inverter']
+        header.extend(self.term_names)
+        header.extend(['RMS Error', 'Max Error', 'Points'])
+        with open(csv_file, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            for i in range(len(self.gain)):
+                # Nothing to flash for an inverter without a fit
+                if not self.fitted[i]:
+                    continue
+                row = [i + 1]
+                row.extend(self.coefficients[i].tolist())
+                row.extend([self.rms_error[i], self.max_error[i], int(self.points[i])])
+                writer.writerow(row)
+        print(f"Coefficients written to {csv_file}")
+        if self.unfitted():
+            print(f"Inverters {[i + 1 for i in self.unfitted()]} not fitted, left out of {csv_file}")
+
+
+class calibration_fit:
+
+    def __init__(self, degree=1, breakpoints=None):
+        # degree 1 is gain/offset, higher adds x^2, x^3 ... terms
+        # breakpoints add max(0, x - b) terms for a piecewise linear fit
+        self.degree = max(1, degree)
+        self.breakpoints = [] if breakpoints is None else list(breakpoints)
+
+    def term_names(self):
+        names = ['Offset', 'Gain']
+        names.extend([f'x^{p}' for p in range(2, self.degree + 1)])
+        names.extend([f'max(0, x - {b})' for b in self.breakpoints])
+        return names
+
+    def design(self, measured):
+        # (setpoint x inverter) -> (inverter x setpoint x term)
+        x = measured.T
+        terms = [np.ones_like(x)]
+        terms.extend(x ** p for p in range(1, self.degree + 1))
+        terms.extend(np.maximum(x - b, 0.0) for b in self.breakpoints)
+        return np.stack(terms, axis=-1)
+
+    def fit(self, setpoints, measured):
+        setpoints = np.asarray(setpoints, dtype=np.float64)
+        measured = np.asarray(measured, dtype=np.float64)
+        # Rows that are not measured yet or channels that came back nan get zero weight
+        valid = ~np.isnan(measured).T & ~np.isnan(setpoints)[np.newaxis, :]
+        A = self.design(np.where(valid.T, measured, 0.0))
+        y = np.where(valid, setpoints[np.newaxis, :], 0.0)
+
+        # Batched least squares for all inverters at once, pinv also copes with too few points
+        weighted = A * valid[..., np.newaxis]
+        coefficients = np.einsum('ktn,kn->kt', np.linalg.pinv(weighted), y)
+        # pinv returns a minimum norm answer for too few points, that is not a calibration
+        points = valid.sum(axis=1)
+        coefficients[points < len(self.term_names())] = np.nan
+
+        predicted = np.einsum('knt,kt->kn', A, coefficients)
+        residuals = np.where(valid, predicted - y, np.nan).T
+        return calibration_result(self.term_names(), coefficients, residuals, points)
+
+    def apply(self, coefficients, measured):
+        # Corrected values for (setpoint x inverter) measurements
+        A = self.design(np.asarray(measured, dtype=np.float64))
+        return np.einsum('knt,kt->kn', A, coefficients).T
+
+
+def fit_run(dm, degree=1, breakpoints=None):
+    # Fit gain/offset per inverter from the sweep data of a data_manager and write the tables to flash
+    fit = calibration_fit(degree, breakpoints)
+    voltage_fit = fit.fit(*dm.voltage_data())
+    voltage_fit.report("Voltage")
+    voltage_fit.to_csv(os.path.join(dm.get_run_dir(), "calibration_voltage_coefficients.csv"))
+    current_fit = fit.fit(*dm.current_data())
+    current_fit.report("Current")
+    current_fit.to_csv(os.path.join(dm.get_run_dir(), "calibration_current_coefficients.csv"))
+    return voltage_fit, current_fit
@@ -0,0 +1,563 @@
+# Import other libraries
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import sweep_clock as SC
+import step_profiler as SP
+import kpsu_controller as KPSU
+import data_manager as DM
+import particle_manager as PM
+import particle_events as PE
+import thermal_model as TM
+import sweep_engine as SE
+import adaptive_sweep as AS
+import calibration_fit as CF
+import sample_stats as SS
+import calibration_cache as CC
+import sweep_planner as SPL
+import waveform as WF
+
+'''
+calibration station class
+Functionality:
+1) One rig: a keysight psu, a particle device and the data manager for its inverters
+2) Contains the voltage sweep, current sweep, deadline scheduled sign wave and calibration fit for that rig
+3) Adaptive sweeps only add setpoints where the calibration fit needs them
+4) Reports sweep progress through an optional callback so several stations can run side by side
+5) Readings are polled from the particle cloud functions or, with ingest_mode 'stream', taken from
+   the device event stream as the first reading published after the psu settled
+6) Optionally takes several readings per setpoint and stores their outlier rejected mean and spread
+7) Caches the fitted coefficients per inverter id, quick_calibration() only runs the full sweeps
+   when a short verification sweep is out of tolerance against the cached curves
+8) combined_sweep() runs both sweeps as one schedule with voltage steps filling the current cooldowns
+9) Archives the run and its fit into dm.database_file when one is set
+'''
+
+class calibration_station:
+
+    def __init__(self, name="station", ip_address=None, device_id=None, access_token=None,
+                 inverter_count=3, save_directory=None, clock=None):
+        self.name = name
+        # Shared by every part of the station, pass sweep_clock.virtual_clock() for a dry run
+        self.clock = clock if clock is not None else SC.system_clock()
+
+        # Initalize classes
+        self.kpsu = KPSU.kn57psu_controller(self.clock)
+        if ip_address is not None:
+            self.kpsu.ip_address = ip_address
+        self.pm = PM.particle_manager(self.clock)
+        if device_id is not None:
+            self.pm.device_id = device_id
+        if access_token is not None:
+            self.pm.access_token = access_token
+
+        self.dm = DM.data_manager(inverter_count, self.kpsu.voltage_setpoints(), self.kpsu.current_setpoints(),
+                                  clock=self.clock)
+        if save_directory is not None:
+            self.dm.save_directory = save_directory
+        self.dm.metadata = {'station': name, 'psu_ip_address': self.kpsu.ip_address,
+                            'v_delay': self.kpsu.v_delay, 'c_settle_delay': self.kpsu.c_settle_delay,
+                            'stable_curr': self.kpsu.stable_curr, 'particle_device_id': self.pm.device_id}
+        self.thermal = TM.thermal_model(self.kpsu.c_factor)
+
+        # Seconds each current step stays powered, psu settle upper bound plus the particle read timeout
+        self.current_step_duration = self.kpsu.c_settle_delay + self.pm.timeout[1]
+        # Seconds every further round of samples can add, see current_heat_duration()
+        self.sample_read_duration = self.pm.timeout[1]
+
+        # Also wait for the inverter readings of the running sweep to be stable when settling, see set_sweep()
+        self.settle_on_inverters = False
+
+        # 'poll' calls getVoltages / getCurrents every step, 'stream' subscribes to the published
+        # "voltages" / "currents" events and uses the first one after the psu settled
+        self.ingest_mode = 'poll'
+        self.events = PE.particle_event_stream(self.pm, self.clock)
+        # Unix time the psu output last settled, readings from the stream must be newer
+        self.settled_at = 0.0
+
+        # Readings per setpoint, several are combined with a median / MAD outlier rejection and
+        # stored as mean plus standard deviation per inverter
+        self.samples_per_setpoint = 1
+        # Samples further than this many scaled MADs from the median are dropped
+        self.outlier_threshold = 3.5
+        # Send the polls of one setpoint in parallel, the cloud queues them for the device
+        self.concurrent_samples = True
+
+        # One profiler for the whole station, exported to the run directory after each sweep
+        self.profiler = SP.step_profiler(self.clock)
+        self.kpsu.profiler = self.profiler
+        self.pm.profiler = self.profiler
+        self.dm.profiler = self.profiler
+
+        # Tolerances for the adaptive sweeps, fit residual and spread of residuals between inverters
+        self.adaptive_v_tolerance = 0.01
+        self.adaptive_v_spread = 0.02
+        self.adaptive_c_tolerance = 0.01
+        self.adaptive_c_spread = 0.02
+
+        # Seconds to wait with the psu off after each sweep
+        self.finish_delay = 10
+
+        # Expected seconds per particle read, only used for runtime estimates
+        self.read_time_estimate = 1.0
+
+        # Fitted coefficients by inverter id, defaults to calibration_cache.json in the save directory
+        self.cache_file = None
+        # Ids reported by the particle device, read once per station
+        self.inverter_ids = None
+        # Setpoints measured by the verification sweep and the max error allowed against the cached curve
+        self.verify_v_points = 5
+        self.verify_c_points = 3
+        self.verify_v_tolerance = 0.05
+        self.verify_c_tolerance = 0.05
+
+        # Optional progress(station name, sweep, steps done, steps total) callback
+        self.progress = None
+
+    def report_progress(self, sweep, done, total):
+        if self.progress is not None:
+            self.progress(self.name, sweep, done, total)
+
+    def export_profile(self):
+        # Where the wall-clock went, p50/p95 per phase plus every span as json and csv
+        if not self.profiler.enabled:
+            return
+        self.profiler.report()
+        run_dir = self.dm.get_run_dir()
+        self.profiler.to_json(os.path.join(run_dir, "profile.json"))
+        self.profiler.to_csv(os.path.join(run_dir, "profile.csv"))
+
+    def set_sweep(self, sweep):
+        # 'volts' or 'current', the settle probe follows the sweep so current steps wait on the inverter currents
+        self.kpsu.set_vc_flag(sweep)
+        if self.settle_on_inverters:
+            if sweep == 'current':
+                self.kpsu.settle_probe = self.pm.get_measured_currents
+            else:
+                self.kpsu.settle_probe = self.pm.get_measured_voltages
+
+    def current_heat_duration(self):
+        # Longest a current step stays powered with samples_per_setpoint readings, used by the thermal plan
+        count = max(1, self.samples_per_setpoint)
+        if self.ingest_mode == 'poll' and self.concurrent_samples:
+            # Parallel polls come back in rounds of pool_size
+            rounds = math.ceil(count / min(count, self.pm.pool_size))
+        else:
+            # Sequential polls, or the stream waiting up to a read timeout per event
+            rounds = count
+        return self.current_step_duration + (rounds - 1) * self.sample_read_duration
+
+    def take_samples(self, poll, event):
+        # samples_per_setpoint readings of the current psu output
+        count = self.samples_per_setpoint
+        if self.ingest_mode == 'stream':
+            return self.events.readings_after(event, self.settled_at, count)
+        if count <= 1 or not self.concurrent_samples:
+            return [poll() for i in range(count)]
+        step = self.profiler.current_step()
+
+        def sample():
+            self.profiler.set_step(step)
+            return poll()
+
+        with ThreadPoolExecutor(max_workers=min(count, self.pm.pool_size)) as pool:
+            futures = [pool.submit(sample) for i in range(count)]
+            return [future.result() for future in futures]
+
+    def measure(self, poll, event):
+        # Returns (readings, spread, kept samples), spread and kept are None for a single reading
+        samples = self.take_samples(poll, event)
+        if len(samples) == 1:
+            return samples[0], None, None
+        with self.profiler.span('aggregate'):
+            samples = np.array([self.dm.vstore.parse(sample) for sample in samples])
+            readings, spread, kept = SS.robust_aggregate(samples, self.outlier_threshold)
+        print(f"Kept {kept.tolist()} of {len(samples)} samples, std {np.round(spread, 6).tolist()}")
+        return readings.tolist(), spread.tolist(), kept.tolist()
+
+    def measure_voltages(self):
+        return self.measure(self.pm.get_measured_voltages, self.events.volt_event)
+
+    def measure_currents(self):
+        return self.measure(self.pm.get_measured_currents, self.events.curr_event)
+
+    def finish_ingest(self):
+        if self.ingest_mode == 'stream':
+            self.events.latency_report()
+            self.events.stop()
+        else:
+            self.pm.latency_report()
+
+    def run_voltage_steps(self, setpoints, total):
+        # Measure the given voltage setpoints, the caller holds the psu session
+        kpsu, dm = self.kpsu, self.dm
+        # PSU readback by setpoint, stored with the inverter readings
+        readbacks = {}
+
+        def set_point(volt_inc):
+            readbacks[volt_inc] = kpsu.control_power_supply(voltage_setpoint=volt_inc, current_setpoint=kpsu.stable_curr)
+            self.settled_at = self.clock.wall_time()
+
+        def record(volt_inc, measurement):
+            measured_voltages, spread, kept = measurement
+            dm.append_voltages([volt_inc] + measured_voltages, readbacks.pop(volt_inc, None), spread, kept)
+            self.report_progress('volts', dm.vstore.measured_count(), total)
+
+        engine = SE.sweep_engine(set_point, self.measure_voltages, record, clock=self.clock,
+                                 profiler=self.profiler, name='volts')
+        try:
+            engine.run(setpoints)
+        except Exception as e:
+            print(f"An unexpected voltage sweep error occurred:")
+            raise e
+
+    def finish_voltage_sweep(self):
+        self.dm.save_run()
+        self.dm.close_stream('volts')
+        self.kpsu.settle_report()
+        self.finish_ingest()
+        self.export_profile()
+        self.clock.sleep(self.finish_delay)
+        print("Finished Voltage Measurements")
+
+    def full_voltage_sweep(self, resume=False):
+        kpsu, dm = self.kpsu, self.dm
+        self.set_sweep('volts')
+        # Rows go to disk as they are measured, resume skips setpoints a crashed run already measured
+        completed = dm.start_stream('volts', resume, self.samples_per_setpoint > 1)
+        setpoints = [volt_inc for volt_inc in kpsu.voltage_setpoints() if volt_inc not in completed]
+        total = len(completed) + len(setpoints)
+        self.report_progress('volts', len(completed), total)
+        # One psu session for the whole sweep, leaving the with block turns off the psu
+        with kpsu:
+            self.run_voltage_steps(setpoints, total)
+        self.finish_voltage_sweep()
+
+    def adaptive_voltage_sweep(self, resume=False):
+        # Coarse grid first, then only the setpoints where the fit residuals or spread are over tolerance
+        kpsu, dm = self.kpsu, self.dm
+        self.set_sweep('volts')
+        completed = dm.start_stream('volts', resume, self.samples_per_setpoint > 1)
+        refiner = AS.adaptive_refiner(kpsu.voltage_setpoints(), self.adaptive_v_tolerance, self.adaptive_v_spread)
+        pending = [volt_inc for volt_inc in refiner.initial_points() if volt_inc not in completed]
+        if not pending and completed:
+            # Resumed after the coarse round, carry on refining from the recovered rows
+            pending = refiner.refine(*dm.voltage_data())
+            print(f"Adaptive voltage sweep resumed: adding {len(pending)} setpoints")
+        with kpsu:
+            while pending:
+                self.run_voltage_steps(pending, dm.vstore.measured_count() + len(pending))
+                pending = refiner.refine(*dm.voltage_data())
+                print(f"Adaptive voltage sweep round {refiner.rounds}: adding {len(pending)} setpoints")
+        print(f"Measured {dm.vstore.measured_count()} of {len(refiner.grid)} voltage setpoints")
+        self.finish_voltage_sweep()
+
+    def voltage_sign_wave(self, shape='triangle', frequency=None, sample_rate=None, cycles=1, duration=None):
+        # Defaults match the old sweep: start_v_value to max_voltage and back in increment_v steps
+        # every v_delay seconds, now on fixed deadlines and bounded by cycles or duration
+        kpsu = self.kpsu
+        self.set_sweep('volts')
+        if sample_rate is None:
+            sample_rate = 1.0 / kpsu.v_delay
+        if frequency is None:
+            steps = 2 * round((kpsu.max_voltage - kpsu.start_v_value) / kpsu.increment_v)
+            frequency = sample_rate / steps
+        generator = WF.waveform_generator(kpsu, self.clock)
+        stats = generator.run(shape, kpsu.start_v_value, kpsu.max_voltage, frequency, sample_rate,
+                              kpsu.max_current, cycles=None if duration is not None else cycles,
+                              duration=duration)
+        self.clock.sleep(self.finish_delay)
+        print("Finished Voltage sign wave")
+        return stats
+
+    def run_current_steps(self, setpoints, total, reorder=True):
+        # Measure the given current setpoints in thermal model order, the caller holds the psu session
+        # reorder=False keeps the order of an already planned schedule, cooldowns are still enforced
+        kpsu, dm, thermal = self.kpsu, self.dm, self.thermal
+        # Order the steps and cooldowns with the resistor thermal model
+        if reorder:
+            plan = thermal.plan_current_sweep(setpoints, self.current_heat_duration())
+        else:
+            plan = [(curr_inc, 0.0) for curr_inc in setpoints]
+        # Setpoint and start time of the step that is powered right now
+        powered = {'current': None, 'start': None}
+        readbacks = {}
+
+        def heat_powered_step():
+            if powered['current'] is not None:
+                thermal.heat(powered['current'], self.clock.now() - powered['start'])
+                powered['current'] = None
+
+        def set_point(curr_inc):
+            # The previous step stayed powered until its reading came back
+            heat_powered_step()
+            # Recompute from the modeled temperature since steps can finish early
+            dwell = thermal.required_dwell(curr_inc, self.current_heat_duration())
+            if dwell > 0:
+                kpsu.set_voltage(0)
+                print(f"Cooling resistor for {dwell:.1f} s (modeled {thermal.temperature:.1f} C)")
+                with self.profiler.span('cooldown'):
+                    self.clock.sleep(dwell)
+                thermal.cool(dwell)
+            powered['current'] = curr_inc
+            powered['start'] = self.clock.now()
+            # New current setting method see kpsu attributes for more details
+            V = kpsu.c_factor * curr_inc
+            rounded_V = round(V, 3)
+            readbacks[curr_inc] = kpsu.control_power_supply(voltage_setpoint=rounded_V, current_setpoint=kpsu.max_current)
+            self.settled_at = self.clock.wall_time()
+
+        def record(curr_inc, measurement):
+            measured_currents, spread, kept = measurement
+            dm.append_currents([curr_inc] + measured_currents, readbacks.pop(curr_inc, None), spread, kept)
+            self.report_progress('current', dm.cstore.measured_count(), total)
+
+        # The reading finishes while the step is powered, before the next step is programmed
+        engine = SE.sweep_engine(set_point, self.measure_currents, record, clock=self.clock,
+                                 profiler=self.profiler, name='current')
+        try:
+            engine.run([curr_inc for curr_inc, planned_dwell in plan])
+        except Exception as e:
+            print(f"An unexpected current sweep error occurred:")
+            raise e
+        finally:
+            heat_powered_step()
+
+    def finish_current_sweep(self):
+        self.dm.save_run()
+        self.dm.close_stream('current')
+        self.kpsu.settle_report()
+        self.finish_ingest()
+        self.export_profile()
+        self.clock.sleep(self.finish_delay)
+        self.thermal.cool(self.finish_delay)
+        print("Finished Current Measurements")
+
+    def full_current_sweep(self, resume=False):
+        kpsu, dm = self.kpsu, self.dm
+        self.set_sweep('current')
+        completed = dm.start_stream('current', resume, self.samples_per_setpoint > 1)
+        setpoints = [curr_inc for curr_inc in kpsu.current_setpoints() if curr_inc not in completed]
+        total = len(completed) + len(setpoints)
+        self.report_progress('current', len(completed), total)
+        with kpsu:
+            self.run_current_steps(setpoints, total)
+        self.finish_current_sweep()
+
+    def adaptive_current_sweep(self, resume=False):
+        kpsu, dm = self.kpsu, self.dm
+        self.set_sweep('current')
+        completed = dm.start_stream('current', resume, self.samples_per_setpoint > 1)
+        refiner = AS.adaptive_refiner(kpsu.current_setpoints(), self.adaptive_c_tolerance, self.adaptive_c_spread)
+        # The current grid is short, start from every 4th setpoint (every 2 A)
+        refiner.coarse_stride = 4
+        pending = [curr_inc for curr_inc in refiner.initial_points() if curr_inc not in completed]
+        if not pending and completed:
+            pending = refiner.refine(*dm.current_data())
+            print(f"Adaptive current sweep resumed: adding {len(pending)} setpoints")
+        with kpsu:
+            while pending:
+                self.run_current_steps(pending, dm.cstore.measured_count() + len(pending))
+                pending = refiner.refine(*dm.current_data())
+                print(f"Adaptive current sweep round {refiner.rounds}: adding {len(pending)} setpoints")
+        print(f"Measured {dm.cstore.measured_count()} of {len(refiner.grid)} current setpoints")
+        self.finish_current_sweep()
+
+    def sweep_planner(self):
+        kpsu = self.kpsu
+        return SPL.sweep_planner(self.thermal, kpsu.v_delay + self.read_time_estimate,
+                                 kpsu.c_settle_delay + self.read_time_estimate, kpsu.stable_curr,
+                                 self.current_heat_duration())
+
+    def plan_combined_sweep(self, v_setpoints, c_setpoints):
+        # One schedule for both sweeps plus the runtime estimate, before anything is powered
+        planner = self.sweep_planner()
+        steps = planner.plan(v_setpoints, c_setpoints)
+        sequential = planner.sequential_estimate(v_setpoints, c_setpoints, self.finish_delay)
+        print(f"Estimated runtime {planner.estimate / 60:.1f} min "
+              f"(back to back sweeps {sequential / 60:.1f} min)")
+        return steps
+
+    def combined_sweep(self, resume=False):
+        # Voltage and current sweep in one psu session, voltage steps run while the resistor cools
+        kpsu, dm, thermal = self.kpsu, self.dm, self.thermal
+        spread = self.samples_per_setpoint > 1
+        completed_v = dm.start_stream('volts', resume, spread)
+        completed_c = dm.start_stream('current', resume, spread)
+        v_setpoints = [volt_inc for volt_inc in kpsu.voltage_setpoints() if volt_inc not in completed_v]
+        c_setpoints = [curr_inc for curr_inc in kpsu.current_setpoints() if curr_inc not in completed_c]
+        total_v = len(completed_v) + len(v_setpoints)
+        total_c = len(completed_c) + len(c_setpoints)
+        steps = self.plan_combined_sweep(v_setpoints, c_setpoints)
+
+        # Consecutive steps of the same sweep run as one group
+        groups = []
+        for sweep, setpoint, dwell in steps:
+            if groups and groups[-1][0] == sweep:
+                groups[-1][1].append(setpoint)
+            else:
+                groups.append((sweep, [setpoint]))
+
+        start = self.clock.now()
+        with kpsu:
+            for sweep, setpoints in groups:
+                # vc_flag picks the settle delay, readback and settle probe, program_setpoint switches the current limit
+                self.set_sweep(sweep)
+                if sweep == 'volts':
+                    group_start = self.clock.now()
+                    self.run_voltage_steps(setpoints, total_v)
+                    power = max(thermal.voltage_step_power(volt_inc, kpsu.stable_curr) for volt_inc in setpoints)
+                    thermal.dissipate(power, self.clock.now() - group_start)
+                else:
+                    self.run_current_steps(setpoints, total_c, reorder=False)
+        print(f"Combined sweep took {(self.clock.now() - start) / 60:.1f} min")
+
+        dm.save_run()
+        dm.close_stream('volts')
+        dm.close_stream('current')
+        kpsu.settle_report()
+        self.finish_ingest()
+        self.export_profile()
+        self.clock.sleep(self.finish_delay)
+        thermal.cool(self.finish_delay)
+        print("Finished Voltage and Current Measurements")
+
+    def fit_calibration(self, degree=1, breakpoints=None):
+        # Fit gain/offset per inverter from the sweep data and write the tables to flash
+        return CF.fit_run(self.dm, degree, breakpoints)
+
+    def calibration_cache(self):
+        cache_file = self.cache_file
+        if cache_file is None:
+            cache_file = os.path.join(self.dm.save_directory, "calibration_cache.json")
+        return CC.calibration_cache(cache_file)
+
+    def get_inverter_ids(self):
+        if self.inverter_ids is None:
+            self.inverter_ids = self.pm.get_inverter_ids()
+        return self.inverter_ids
+
+    def cache_calibration(self, voltage_fit, current_fit, degree=1, breakpoints=None):
+        # Store the new coefficients of every inverter under its id
+        try:
+            inverter_ids = self.get_inverter_ids()
+        except PM.particle_error as e:
+            print(f"Inverter ids not available, calibration not cached: {e}")
+            return
+        if len(inverter_ids) != self.dm.inverter_count:
+            print(f"Got {len(inverter_ids)} inverter ids for {self.dm.inverter_count} inverters, calibration not cached")
+            return
+        cache = self.calibration_cache()
+        fit = CF.calibration_fit(degree, breakpoints)
+        now = self.clock.wall_time()
+        for index, inverter_id in enumerate(inverter_ids):
+            cache.put(inverter_id, fit, voltage_fit, current_fit, index, now, self.dm.get_run_dir(), self.name)
+        cache.save()
+
+    def spread_points(self, grid, count):
+        # count setpoints evenly spread over the grid, always including both ends
+        if count >= len(grid):
+            return list(grid)
+        last = len(grid) - 1
+        return [grid[round(i * last / (count - 1))] for i in range(count)]
+
+    def verify_calibration(self):
+        # Measure a few setpoints and compare them to the cached curves, returns the inverter ids
+        # that are out of tolerance or have nothing cached
+        kpsu, dm = self.kpsu, self.dm
+        inverter_ids = self.get_inverter_ids()
+        cache = self.calibration_cache()
+        now = self.clock.wall_time()
+        entries = [cache.get(inverter_id, now) for inverter_id in inverter_ids]
+        if len(inverter_ids) != dm.inverter_count:
+            print(f"Got {len(inverter_ids)} inverter ids for {dm.inverter_count} inverters, no verification")
+            return list(inverter_ids)
+        missing = [inverter_id for inverter_id, entry in zip(inverter_ids, entries) if entry is None]
+        if missing:
+            print(f"No cached calibration for {missing}")
+            return list(inverter_ids)
+
+        v_points = self.spread_points(kpsu.voltage_setpoints(), self.verify_v_points)
+        c_points = self.spread_points(kpsu.current_setpoints(), self.verify_c_points)
+        print(f"Verifying cached calibration at {v_points} V and {c_points} A")
+        self.set_sweep('volts')
+        with kpsu:
+            self.run_voltage_steps(v_points, len(v_points))
+        self.clock.sleep(self.finish_delay)
+        self.set_sweep('current')
+        with kpsu:
+            self.run_current_steps(c_points, len(c_points))
+        self.clock.sleep(self.finish_delay)
+        self.thermal.cool(self.finish_delay)
+
+        failed = []
+        report = {}
+        checks = (('voltage', dm.vstore.measured_rows(), self.verify_v_tolerance),
+                  ('current', dm.cstore.measured_rows(), self.verify_c_tolerance))
+        for index, (inverter_id, entry) in enumerate(zip(inverter_ids, entries)):
+            report[inverter_id] = {}
+            for sweep, rows, tolerance in checks:
+                error = np.abs(CC.predict(entry[sweep], rows[:, index + 1]) - rows[:, 0])
+                max_error = float(np.max(error)) if not np.isnan(error).any() else float('nan')
+                passed = max_error <= tolerance
+                report[inverter_id][sweep] = {'max_error': max_error, 'tolerance': tolerance, 'passed': passed}
+                print(f"{inverter_id} {sweep}: max error {max_error:.6f} ({'ok' if passed else 'OUT OF TOLERANCE'})")
+                if not passed and inverter_id not in failed:
+                    failed.append(inverter_id)
+            if inverter_id not in failed:
+                cache.mark_verified(inverter_id, now)
+        cache.save()
+        with open(os.path.join(dm.get_run_dir(), "verification.json"), mode='w') as file:
+            json.dump(report, file, indent=2)
+        return failed
+
+    def quick_calibration(self, adaptive=False, combined=False):
+        # Re-test: verify the cached calibration, run the full calibration only when an inverter fails
+        try:
+            failed = self.verify_calibration()
+        except Exception as e:
+            print(f"Verification stopped: {e}")
+            return False
+        if not failed:
+            self.dm.save_run()
+            # Archived once the verification passed, a verify only run has no fit
+            self.dm.save_to_database(self.inverter_ids)
+            print("All inverters within tolerance of their cached calibration")
+            return True
+        # The rig measures every inverter at once, so the sweeps are shared but start from clean data
+        print(f"Full calibration needed for {failed}")
+        self.dm.clear_data()
+        return self.get_calibration(adaptive=adaptive, combined=combined)
+
+    def get_calibration(self, resume_run_dir=None, adaptive=False, combined=False):
+        # Pass the run directory of a crashed run to resume it, returns True when the calibration finished
+        # combined=True runs both sweeps as one schedule, adaptive sweeps always run back to back
+        resume = resume_run_dir is not None
+        if resume:
+            self.dm.run_dir = resume_run_dir
+        try:
+            if combined and not adaptive:
+                self.combined_sweep(resume)
+            elif adaptive:
+                self.adaptive_voltage_sweep(resume)
+                self.adaptive_current_sweep(resume)
+            else:
+                self.full_voltage_sweep(resume)
+                self.full_current_sweep(resume)
+            voltage_fit, current_fit = self.fit_calibration()
+            self.cache_calibration(voltage_fit, current_fit)
+            # Archived once with its fit, a crashed calibration never reaches the database
+            self.dm.save_to_database(self.inverter_ids, voltage_fit, current_fit)
+            # Only now the sweeps can no longer be resumed
+            self.dm.finish_streams()
+            print("Calibration complete")
+            return True
+        except ConnectionError as e:  # Catch the connection error
+            print(f"Calibration stopped, connection error: {e}")
+            return False
+        except Exception as e:
+            print(f"Calibration stopped: {e}")
+            return False
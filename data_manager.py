@@ -1,87 +1,475 @@
 #Import csv and data library
 import csv
-import numpy as np
+import json
 import os
+import time
+import sweep_clock as SC
+import step_profiler as SP
 
 '''
 data manager class
 Functionality:
 1) Contains code that saves data to csv
 2) Contains code to set voltage and current over LAN
+3) Streams every measured row (with psu readback and timestamp) to disk as it arrives with a journal
+   so a crashed sweep can resume
+4) Keeps readings in preallocated float64 (setpoint x inverter) arrays instead of lists of strings
+5) Saves every run to its own directory as memory mappable .npy arrays, csv is an on demand export
+6) With several samples per setpoint also keeps the standard deviation and kept sample count per inverter
+7) Optionally archives every run into an indexed SQLite database (database_file, see run_database)
 '''
 
+# NumPy is imported when the first column_store is created so importing data_manager stays cheap
+np = None
+
+
+def load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class csv_stream:
+    # config values
+    # Rows between fsyncs, every row is still flushed to the os right away
+    fsync_interval = 10
+
+    def __init__(self, csv_file, header, resume=False):
+        self.csv_file = csv_file
+        self.journal_file = os.path.splitext(csv_file)[0] + ".journal"
+        # Rows already measured by the crashed run when resuming
+        self.rows = []
+
+        if resume and os.path.exists(self.csv_file):
+            self.rows = self.recover(header)
+        if not self.rows:
+            for path in (self.csv_file, self.journal_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.file = open(self.csv_file, mode='a', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(header)
+            self.file.flush()
+        self.rows_since_sync = 0
+
+    def recover(self, header):
+        # Keep only the rows the journal says were completely written, a partial last row is dropped
+        offset = os.path.getsize(self.csv_file)
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file) as file:
+                journal = json.load(file)
+            offset = min(offset, journal['offset'])
+            print(f"Resuming after setpoint {journal['last_setpoint']}")
+        with open(self.csv_file, mode='r+b') as file:
+            file.truncate(offset)
+            file.seek(0)
+            data = file.read()
+            # The csv is only fsynced every fsync_interval rows, so after a power loss the journal
+            # offset can end inside a row, cut back to the last complete line
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                print(f"Dropping partial row {data[end:]!r}")
+                file.truncate(end)
+        lines = list(csv.reader(data[:end].decode().splitlines()))
+        if not lines:
+            return []
+        # Rows of another layout (inverter count, std columns, older format) cannot be resumed
+        if lines[0] != [str(column) for column in header]:
+            print(f"{self.csv_file} has another header, starting the sweep over")
+            return []
+        # Skip the header and anything that did not survive as a full row
+        rows = []
+        for line in lines[1:]:
+            if len(line) != len(lines[0]):
+                print(f"Dropping row with {len(line)} of {len(lines[0])} columns: {line}")
+                continue
+            try:
+                rows.append([float(value) for value in line])
+            except ValueError:
+                print(f"Dropping unreadable row: {line}")
+        print(f"Recovered {len(rows)} rows from {self.csv_file}")
+        return rows
+
+    def completed_setpoints(self):
+        return set(row[0] for row in self.rows)
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+        self.file.flush()
+        self.rows.append(row)
+        self.rows_since_sync += 1
+        if self.rows_since_sync >= self.fsync_interval:
+            self.sync()
+        self.write_journal(row[0])
+
+    def write_journal(self, last_setpoint):
+        # Write to a temp file and swap it in so the journal is never half written
+        journal = {'last_setpoint': last_setpoint, 'rows': len(self.rows), 'offset': self.file.tell()}
+        temp_file = self.journal_file + ".tmp"
+        with open(temp_file, mode='w') as file:
+            json.dump(journal, file)
+        os.replace(temp_file, self.journal_file)
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.rows_since_sync = 0
+
+    def close(self, remove=False):
+        # remove=True once the final csv is written and the run no longer needs resuming
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+        if remove:
+            self.remove()
+
+    def remove(self):
+        for path in (self.csv_file, self.journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class column_store:
+    # Rows added when a setpoint outside the preallocated grid shows up and the array is full
+    grow_rows = 64
+    # Arrays saved to the run directory as <prefix>_<name>.npy
+    array_names = ('setpoints', 'readings', 'timestamps', 'readback', 'filled', 'spread', 'samples')
+
+    def __init__(self, inverter_count, setpoints=None):
+        load_numpy()
+        self.inverter_count = inverter_count
+        setpoints = [] if setpoints is None else list(setpoints)
+        capacity = max(len(setpoints), self.grow_rows)
+        self.setpoints = np.full(capacity, np.nan)
+        self.readings = np.full((capacity, inverter_count), np.nan)
+        # Unix time of each reading and what the psu measured at that setpoint
+        self.timestamps = np.full(capacity, np.nan)
+        self.readback = np.full(capacity, np.nan)
+        self.filled = np.zeros(capacity, dtype=bool)
+        # Standard deviation and number of samples kept per inverter when a setpoint is sampled several times
+        self.spread = np.full((capacity, inverter_count), np.nan)
+        self.samples = np.full((capacity, inverter_count), np.nan)
+        # Row of every known setpoint, rounded so 0.1 + 0.2 finds the 0.3 row
+        self.index = {}
+        self.size = 0
+        for setpoint in setpoints:
+            self.add_row(setpoint)
+
+    def key(self, setpoint):
+        return round(float(setpoint), 6)
+
+    def add_row(self, setpoint):
+        if self.size == len(self.setpoints):
+            # Double the capacity, only happens for setpoints outside the planned grid
+            extra = max(self.size, self.grow_rows)
+            self.setpoints = np.concatenate([self.setpoints, np.full(extra, np.nan)])
+            self.readings = np.concatenate([self.readings, np.full((extra, self.inverter_count), np.nan)])
+            self.timestamps = np.concatenate([self.timestamps, np.full(extra, np.nan)])
+            self.readback = np.concatenate([self.readback, np.full(extra, np.nan)])
+            self.filled = np.concatenate([self.filled, np.zeros(extra, dtype=bool)])
+            self.spread = np.concatenate([self.spread, np.full((extra, self.inverter_count), np.nan)])
+            self.samples = np.concatenate([self.samples, np.full((extra, self.inverter_count), np.nan)])
+        row = self.size
+        self.setpoints[row] = setpoint
+        self.index[self.key(setpoint)] = row
+        self.size += 1
+        return row
+
+    def parse(self, readings):
+        # Parse once on ingest, missing or non numeric channels become nan
+        values = np.full(self.inverter_count, np.nan)
+        readings = list(readings)[:self.inverter_count]
+        try:
+            values[:len(readings)] = np.asarray(readings, dtype=np.float64)
+        except ValueError:
+            for i, reading in enumerate(readings):
+                try:
+                    values[i] = float(reading)
+                except ValueError:
+                    pass
+        return values
+
+    def add(self, setpoint, readings, timestamp, readback=None, spread=None, samples=None):
+        # timestamp is the unix time of the reading on the sweep clock
+        row = self.index.get(self.key(setpoint))
+        if row is None:
+            row = self.add_row(setpoint)
+        self.readings[row] = self.parse(readings)
+        self.timestamps[row] = timestamp
+        if readback is not None:
+            self.readback[row] = float(readback)
+        if spread is not None:
+            self.spread[row] = self.parse(spread)
+        if samples is not None:
+            self.samples[row] = self.parse(samples)
+        self.filled[row] = True
+
+    def save(self, run_dir, prefix):
+        for name in self.array_names:
+            np.save(os.path.join(run_dir, f"{prefix}_{name}.npy"), getattr(self, name)[:self.size])
+
+    def load(self, run_dir, prefix, mmap_mode='c'):
+        # Memory map the saved arrays, 'c' is copy on write so the files are never modified
+        for name in self.array_names:
+            path = os.path.join(run_dir, f"{prefix}_{name}.npy")
+            # Runs saved before spread / samples existed only have a single reading per setpoint
+            if os.path.exists(path) or name not in ('spread', 'samples'):
+                setattr(self, name, np.load(path, mmap_mode=mmap_mode))
+        self.size = len(self.setpoints)
+        if len(self.spread) != self.size:
+            self.spread = np.full((self.size, self.inverter_count), np.nan)
+            self.samples = np.full((self.size, self.inverter_count), np.nan)
+            self.samples[np.asarray(self.filled)] = 1.0
+        self.index = {self.key(setpoint): row for row, setpoint in enumerate(self.setpoints.tolist())}
+
+    def setpoint_view(self):
+        # Zero copy views, rows not measured yet are nan
+        return self.setpoints[:self.size]
+
+    def reading_view(self):
+        return self.readings[:self.size]
+
+    def measured_count(self):
+        return int(np.count_nonzero(self.filled[:self.size]))
+
+    def has_spread(self):
+        return bool(np.isfinite(self.spread[:self.size]).any())
+
+    def measured_rows(self, spread=False):
+        # Measured rows sorted by setpoint with the setpoint as first column, used for export
+        rows = np.flatnonzero(self.filled[:self.size])
+        rows = rows[np.argsort(self.setpoints[rows], kind='stable')]
+        if spread:
+            return np.column_stack([self.setpoints[rows], self.readings[rows], self.spread[rows]])
+        return np.column_stack([self.setpoints[rows], self.readings[rows]])
+
+
 class data_manager:
 
-    def __init__(self, inverter_count):
+    def __init__(self, inverter_count, v_setpoints=None, c_setpoints=None, run_dir=None, clock=None):
         # ['Ref Voltage'], ['Ref Current'], multiplied by inverter ['Measured Voltage'], ['Measured Current']
+        self.save_directory = os.path.join(os.getcwd(), 'calibration_runs')
         # For mac
-        self.save_directory = '/Users/solclarity'
+        # self.save_directory = '/Users/solclarity'
         # For windows
         # self.save_directory = r'C:\Users\bmahabir\Desktop\Calibration CSVs'
-        self.vdata_list = []
-        self.cdata_list = []
+        # Every run gets its own directory under save_directory, pass run_dir to reopen a run
+        self.run_dir = run_dir
+        # Extra run info saved to metadata.json, ex. psu settings or station name
+        self.metadata = {}
         self.inverter_count = inverter_count
+        # Reading timestamps come from the clock so virtual time runs stay consistent
+        self.clock = clock if clock is not None else SC.system_clock()
+        # Timing of appends and saves, enabled by calibration_station
+        self.profiler = SP.step_profiler(self.clock, enabled=False)
+        # Planned sweep setpoints so the arrays can be allocated up front, see kpsu.voltage_setpoints()
+        self.v_setpoints = v_setpoints
+        self.c_setpoints = c_setpoints
+        self.vstore = column_store(inverter_count, v_setpoints)
+        self.cstore = column_store(inverter_count, c_setpoints)
+        # Open csv_stream by sweep, 'volts' or 'current'
+        self.streams = {}
+        # Streams of finished sweeps, kept on disk until the whole calibration is done
+        self.closed_streams = []
+        # Sweeps whose stream rows carry a standard deviation column per inverter
+        self.spread_streams = set()
+        # SQLite archive of all runs, None keeps the run directory only
+        self.database_file = None
 
-    
-    def append_voltages(self, ref_voltages):
-        self.vdata_list.append(ref_voltages)
+    def get_run_dir(self):
+        # Created on first use so a data_manager can be built without touching the disk
+        if self.run_dir is None:
+            self.run_dir = os.path.join(self.save_directory, time.strftime("run_%Y%m%d_%H%M%S"))
+        os.makedirs(self.run_dir, exist_ok=True)
+        return self.run_dir
+
+    def voltage_header(self, spread=False):
+        # Generate header dynamically based on the number of inverters
+        header = ['PSU Reference Voltage']
+        header.extend([f'Inverter {i} Voltage(V)' for i in range(1, self.inverter_count + 1)])
+        if spread:
+            header.extend([f'Inverter {i} Voltage Std(V)' for i in range(1, self.inverter_count + 1)])
+        return header
+
+    def current_header(self, spread=False):
+        header = ['PSU Reference Current']
+        header.extend([f'Inverter {i} Current(A)' for i in range(1, self.inverter_count + 1)])
+        if spread:
+            header.extend([f'Inverter {i} Current Std(A)' for i in range(1, self.inverter_count + 1)])
+        return header
+
+    def stream_header(self, sweep, spread=False):
+        # Export columns plus what is needed to restore the arrays exactly on resume
+        header = self.voltage_header(spread) if sweep == 'volts' else self.current_header(spread)
+        header.extend(['PSU Readback', 'Timestamp'])
+        return header
+
+    def start_stream(self, sweep, resume=False, spread=False):
+        # Append rows to disk as they are measured, returns the setpoints already done when resuming
+        # spread=True adds a standard deviation column per inverter for multi sample sweeps
+        if sweep == 'volts':
+            csv_file = os.path.join(self.get_run_dir(), "calibration_voltages_stream.csv")
+            store = self.vstore
+        else:
+            csv_file = os.path.join(self.get_run_dir(), "calibration_currents_stream.csv")
+            store = self.cstore
+        stream = csv_stream(csv_file, self.stream_header(sweep, spread), resume)
+        count = self.inverter_count
+        # setpoint, readings, std per inverter when spread, psu readback, timestamp
+        for row in stream.rows:
+            store.add(row[0], row[1:count + 1], row[-1], row[-2],
+                      spread=row[count + 1:2 * count + 1] if spread else None)
+        if spread:
+            self.spread_streams.add(sweep)
+        else:
+            self.spread_streams.discard(sweep)
+        self.streams[sweep] = stream
+        return stream.completed_setpoints()
+
+    def close_stream(self, sweep):
+        # Sweep finished, the stream stays on disk so a crash in a later sweep can still resume this one
+        stream = self.streams.pop(sweep, None)
+        if stream is not None:
+            stream.close()
+            self.closed_streams.append(stream)
+
+    def finish_streams(self):
+        # Call once the whole calibration is saved, the streams and journals are no longer needed
+        for sweep in list(self.streams):
+            self.close_stream(sweep)
+        for stream in self.closed_streams:
+            stream.remove()
+        self.closed_streams = []
+
+    def stream_row(self, sweep, row, readback, timestamp, spread):
+        row = list(row)
+        if sweep in self.spread_streams:
+            row.extend([float('nan')] * self.inverter_count if spread is None else list(spread))
+        row.extend([float('nan') if readback is None else float(readback), timestamp])
+        self.streams[sweep].write_row(row)
+
+    def append_voltages(self, ref_voltages, psu_readback=None, spread=None, samples=None):
+        # ref_voltages is [psu setpoint, inverter 1, inverter 2, ...]
+        # spread / samples are the per inverter standard deviation and kept sample count
+        with self.profiler.span('data_append'):
+            timestamp = self.clock.wall_time()
+            self.vstore.add(ref_voltages[0], ref_voltages[1:], timestamp, psu_readback, spread, samples)
+            if 'volts' in self.streams:
+                self.stream_row('volts', ref_voltages, psu_readback, timestamp, spread)
         
     
-    def append_currents(self, ref_currents):
-        self.cdata_list.append(ref_currents)
+    def append_currents(self, ref_currents, psu_readback=None, spread=None, samples=None):
+        with self.profiler.span('data_append'):
+            timestamp = self.clock.wall_time()
+            self.cstore.add(ref_currents[0], ref_currents[1:], timestamp, psu_readback, spread, samples)
+            if 'current' in self.streams:
+                self.stream_row('current', ref_currents, psu_readback, timestamp, spread)
+
+    def voltage_data(self):
+        # (setpoints, setpoint x inverter readings) views without copying, unmeasured rows are nan
+        return self.vstore.setpoint_view(), self.vstore.reading_view()
+
+    def current_data(self):
+        return self.cstore.setpoint_view(), self.cstore.reading_view()
 
     def voltages_to_csv(self):
-        #Convert list to numpy
-        data_array = np.array(self.vdata_list)
+        # Measured rows sorted by reference voltage, plus the std columns of multi sample sweeps
+        spread = self.vstore.has_spread()
+        data_array = self.vstore.measured_rows(spread)
 
         # Specify the CSV file name
-        csv_file = os.path.join(self.save_directory, "calibration_voltages.csv")
+        csv_file = os.path.join(self.get_run_dir(), "calibration_voltages.csv")
 
-        # Generate header dynamically based on the number of inverters
-        header = ['PSU Reference Voltage']
-        header.extend([f'Inverter {i} Voltage(V)' for i in range(1, self.inverter_count + 1)])
+        header = self.voltage_header(spread)
         
         # Write the collected data to a CSV file
         with open(csv_file, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(header)
-            writer.writerows(data_array)  # Write data
+            writer.writerows(data_array.tolist())  # Write data
 
         print(f"Data written to {csv_file}")
 
     def currents_to_csv(self):
-        #Convert list to numpy
-        data_array = np.array(self.cdata_list)
+        # Measured rows sorted by reference current since the sweep can be reordered
+        spread = self.cstore.has_spread()
+        data_array = self.cstore.measured_rows(spread)
 
         # Specify the CSV file name
-        csv_file = os.path.join(self.save_directory, "calibration_currents.csv")
+        csv_file = os.path.join(self.get_run_dir(), "calibration_currents.csv")
 
-        # Generate header dynamically based on the number of inverters
-        header = ['PSU Reference Current']
-        header.extend([f'Inverter {i} Current(A)' for i in range(1, self.inverter_count + 1)])
+        header = self.current_header(spread)
 
         # Write the collected data to a CSV file
         with open(csv_file, mode='w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(header)
-            writer.writerows(data_array)  # Write data
+            writer.writerows(data_array.tolist())  # Write data
 
         print(f"Data written to {csv_file}")
     
+    def save_run(self):
+        # Binary arrays plus metadata.json, load_run() maps them back without parsing
+        run_dir = self.get_run_dir()
+        with self.profiler.span('save_run'):
+            self.vstore.save(run_dir, 'voltage')
+            self.cstore.save(run_dir, 'current')
+        metadata = dict(self.metadata)
+        metadata.update({
+            'format_version': 2,
+            'inverter_count': self.inverter_count,
+            'saved': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.clock.wall_time())),
+            'voltage_rows': self.vstore.measured_count(),
+            'current_rows': self.cstore.measured_count(),
+        })
+        with open(os.path.join(run_dir, "metadata.json"), mode='w') as file:
+            json.dump(metadata, file, indent=2)
+        print(f"Run saved to {run_dir}")
+
+    def save_to_database(self, inverter_ids=None, voltage_fit=None, current_fit=None):
+        # Store or replace this run in the database_file archive, returns the run id
+        if self.database_file is None:
+            return None
+        import run_database as RD
+        with self.profiler.span('save_database'):
+            with RD.run_database(self.database_file) as database:
+                return database.store_run(self, self.clock.wall_time(), inverter_ids, voltage_fit, current_fit)
+
+    def export_csv(self):
+        # On demand text export of a run
+        if self.vstore.measured_count():
+            self.voltages_to_csv()
+        if self.cstore.measured_count():
+            self.currents_to_csv()
+    
     def get_vsize(self):
-        num_rows = len(self.vdata_list)
-        num_columns = len(self.vdata_list[0]) if self.vdata_list else 0  # Check if there are any rows      
+        num_rows = self.vstore.measured_count()
+        num_columns = self.inverter_count + 1 if num_rows else 0  # Check if there are any rows      
         print(f"vNumber of rows: {num_rows}")
         print(f"vNumber of columns: {num_columns}")
 
     def get_csize(self):
-        num_rows = len(self.cdata_list)
-        num_columns = len(self.vdata_list[0]) if self.vdata_list else 0  # Check if there are any rows      
+        num_rows = self.cstore.measured_count()
+        num_columns = self.inverter_count + 1 if num_rows else 0  # Check if there are any rows      
         print(f"cNumber of rows: {num_rows}")
         print(f"cNumber of columns: {num_columns}")
     
     def clear_data(self):
-        self.vdata_list = []
-        self.cdata_list = []
+        self.vstore = column_store(self.inverter_count, self.v_setpoints)
+        self.cstore = column_store(self.inverter_count, self.c_setpoints)
         self.get_vsize()
         self.get_csize()
+
+
+def load_run(run_dir, mmap_mode='c'):
+    # Reopen a saved run, the arrays are memory mapped so even large runs load instantly
+    with open(os.path.join(run_dir, "metadata.json")) as file:
+        metadata = json.load(file)
+    dm = data_manager(metadata['inverter_count'], run_dir=run_dir)
+    dm.metadata = metadata
+    dm.vstore.load(run_dir, 'voltage', mmap_mode)
+    dm.cstore.load(run_dir, 'current', mmap_mode)
+    return dm
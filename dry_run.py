@@ -0,0 +1,85 @@
+# Import other libraries
+import argparse
+import os
+import tempfile
+from contextlib import redirect_stdout
+
+import sweep_clock as SC
+import calibration_station as CS
+import psu_simulator as PS
+import particle_simulator as PSIM
+
+'''
+dry run
+Functionality:
+1) Runs the complete calibration plan against the simulated power supply and particle cloud
+   on a virtual clock, so hours of v_delay / c_settle_delay / cooldown waits finish in seconds
+2) Reports the estimated duration of every sweep and checks every planned setpoint was measured
+3) Uses the same delays, settle mode and thermal model as a real run
+4) combined=True runs both sweeps as the single combined schedule instead of back to back
+'''
+
+def format_duration(seconds):
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours} h {minutes:02d} min {seconds:02d} s"
+
+
+def dry_run(inverter_count=3, settle_mode='fixed', sweeps=('volts', 'current'), adaptive=False, verbose=False,
+            combined=False):
+    clock = SC.virtual_clock()
+    supply = PS.simulated_power_supply(clock)
+    cloud = PSIM.particle_simulator(supply, inverter_count)
+    estimates = {}
+
+    with tempfile.TemporaryDirectory() as save_directory:
+        station = CS.calibration_station(name="dry run", device_id="dry run", inverter_count=inverter_count,
+                                         save_directory=save_directory, clock=clock)
+        station.kpsu.rm = PS.simulated_resource_manager(supply)
+        # Open output for the voltage sweep, test load for the current sweep
+        station.kpsu.load_switch = supply.connect_load
+        station.kpsu.settle_mode = settle_mode
+        # Cloud calls are answered in process, their latency is spent on the virtual clock
+        station.pm.call_function = cloud.local_call
+
+        planned = {'volts': len(station.kpsu.voltage_setpoints()), 'current': len(station.kpsu.current_setpoints())}
+        if combined:
+            start = clock.now()
+            with redirect_stdout(None if verbose else open(os.devnull, 'w')):
+                station.combined_sweep()
+            estimates['combined'] = clock.now() - start
+            measured = station.dm.vstore.measured_count() + station.dm.cstore.measured_count()
+            total = planned['volts'] + planned['current']
+            status = "ok" if measured == total else f"MISSING {total - measured} setpoints"
+            print(f"combined sweep: {measured}/{total} setpoints, estimated {format_duration(estimates['combined'])} ({status})")
+            sweeps = ()
+        for sweep in sweeps:
+            start = clock.now()
+            with redirect_stdout(None if verbose else open(os.devnull, 'w')):
+                if sweep == 'volts':
+                    station.adaptive_voltage_sweep() if adaptive else station.full_voltage_sweep()
+                else:
+                    station.adaptive_current_sweep() if adaptive else station.full_current_sweep()
+            estimates[sweep] = clock.now() - start
+            store = station.dm.vstore if sweep == 'volts' else station.dm.cstore
+            measured = store.measured_count()
+            if adaptive:
+                status = "adaptive"
+            else:
+                status = "ok" if measured == planned[sweep] else f"MISSING {planned[sweep] - measured} setpoints"
+            print(f"{sweep} sweep: {measured}/{planned[sweep]} setpoints, estimated {format_duration(estimates[sweep])} ({status})")
+
+        print(f"PSU round trips: {supply.round_trips}, cloud calls: {cloud.requests}")
+        print(f"Estimated total: {format_duration(sum(estimates.values()))}")
+    return estimates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the duration of a calibration run in virtual time")
+    parser.add_argument('--inverters', type=int, default=3)
+    parser.add_argument('--settle', choices=['fixed', 'adaptive'], default='fixed')
+    parser.add_argument('--adaptive', action='store_true', help="plan the adaptive sweeps instead of the full grid")
+    parser.add_argument('--combined', action='store_true', help="plan both sweeps as one combined schedule")
+    parser.add_argument('--verbose', action='store_true', help="show the sweep output")
+    args = parser.parse_args()
+    dry_run(args.inverters, args.settle, adaptive=args.adaptive, verbose=args.verbose, combined=args.combined)
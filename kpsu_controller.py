@@ -1,8 +1,9 @@
 # Import other libraries
-import time
+import sys
+import sweep_clock as SC
+import step_profiler as SP
 
-# Import library that interfaces with the keysight power supply 
-import pyvisa
+# pyvisa, the library that interfaces with the keysight power supply, is imported on first connect
 
 '''
 kn57psu_controller class
@@ -10,15 +11,30 @@ Functionality:
 1) Contains code necessary to interface with a keysight N5767A Power Supply, 60 V, 25 A, 1500 W
 2) Contains code to set voltage and current over LAN
 3) TO DO: Create a class that controls the e36300 power supply
+4) Can batch the program and readback of a setpoint into chained SCPI messages (2 round trips)
 '''
 
+def is_visa_io_error(e):
+    # Checked without importing pyvisa, a simulated resource manager never loads it
+    pyvisa = sys.modules.get('pyvisa')
+    return pyvisa is not None and isinstance(e, pyvisa.errors.VisaIOError)
+
+
+class psu_error(Exception):
+    # Raised when SYST:ERR? reports an error after a batched setpoint,
+    # or when a setpoint could not be applied within a session
+    pass
+
 class kn57psu_controller:
     # config values
     ip_address = "10.10.223.99"
     max_retry_attempts = 3
     v_delay = 10
-    # 30 Seconds to Wait for Resistor to Dissipate Heat
+    # 30 Seconds to Wait for Resistor to Dissipate Heat, only used by current_sweep_check()
     c_delay = 60
+    # Upper bound for a current sweep step to settle, the resistor cooldown between steps
+    # comes from the station thermal model instead of a fixed wait while powered
+    c_settle_delay = 10
     # Start inc and limit values for voltage sweep
     start_v_value = 0.0
     increment_v = 0.10
@@ -55,23 +71,124 @@ class kn57psu_controller:
     #Stable current value for voltage sweep
     stable_curr = 0.2
 
-    def __init__(self):
+    # Settle mode after each setpoint
+    # 'fixed' sleeps v_delay / c_settle_delay
+    # 'adaptive' polls MEAS:VOLT? / MEAS:CURR? and continues as soon as the last
+    # settle_samples readings are within the tolerance band, v_delay / c_settle_delay
+    # are kept as the upper bound
+    settle_mode = 'fixed'
+    settle_poll_interval = 0.5
+    settle_v_tolerance = 0.005
+    settle_c_tolerance = 0.005
+    settle_samples = 3
+    # Tolerance for the optional settle_probe readings (ex. particle measurements)
+    settle_probe_tolerance = 0.01
+
+    # Send VOLT, CURR, OUTP ON and *OPC? as one message and MEAS:VOLT?, MEAS:CURR?, SYST:ERR?
+    # as a second one instead of a round trip per command
+    batch_scpi = True
+
+    def __init__(self, clock=None):
         #default value
         self.vc_flag = 'volts'
-    
+        # Every wait goes through the clock so a sweep can run in virtual time
+        self.clock = clock if clock is not None else SC.system_clock()
+        # Timing of connects, SCPI messages and settle waits, enabled by calibration_station
+        self.profiler = SP.step_profiler(self.clock, enabled=False)
+        # Persistent session state, see open_session()
+        self.rm = None
+        self.ps = None
+        self.session_active = False
+        self.output_enabled = False
+        # Optional function returning extra readings to wait on, ex. pm.get_measured_voltages
+        self.settle_probe = None
+        # Optional function switching the 100/27 ohm current sweep load (ex. a relay), called by
+        # set_vc_flag with True for the current sweep and False for the open voltage sweep
+        self.load_switch = None
+        # (upper bound, actual settle time) in seconds for every step
+        self.settle_times = []
+        # SCPI round trips to the psu (every write or query)
+        self.round_trips = 0
+
+    def scpi_write(self, command):
+        self.round_trips += 1
+        with self.profiler.span('scpi_write', command):
+            self.ps.write(command)
+
+    def scpi_query(self, command):
+        self.round_trips += 1
+        with self.profiler.span('scpi_query', command):
+            return self.ps.query(command)
+
+    def __enter__(self):
+        self.open_session()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_session()
+        return False
+
+    def open_session(self):
+        # Keep one connection open for a whole sweep instead of reconnecting every setpoint
+        self.connect_to_power_supply()
+        if not self.check_connection():
+            self.reconnect()
+        self.session_active = True
+        print("Power supply session opened")
+
+    def close_session(self):
+        # Set voltage and current low, turn off output and close the connection
+        try:
+            self.disable_output()
+            self.set_voltage(0)
+            self.set_current(0)
+        except Exception as e:
+            print(f"Could not reset psu while closing session: {e}")
+        finally:
+            self.session_active = False
+            self.close_resource()
+            print("Power supply session closed")
+
+    def check_connection(self):
+        # Health check, the psu should answer *OPC? with 1
+        try:
+            return self.scpi_query('*OPC?').strip() == '1'
+        except Exception as e:
+            print(f"Power supply health check failed: {e}")
+            return False
+
+    def reconnect(self):
+        print("Reconnecting to power supply")
+        try:
+            self.close_resource()
+        except Exception:
+            pass  # The old connection is already gone
+        self.connect_to_power_supply()
+        # Output state is unknown after a reconnect
+        self.output_enabled = False
+
     def connect_to_power_supply(self):
+        # Reuse the open connection while a session is active
+        if self.session_active and self.ps is not None:
+            return
+
         # Actual Voltage and current return from keysight powersupply measurement
         # Replace 'TCPIP0::192.168.1.100::inst0::INSTR' with your instrument's VISA resource address
         visa_resource = f"TCPIP::{self.ip_address}::INSTR"
 
-        # Initialize the VISA resource manager
-        rm = pyvisa.ResourceManager()
+        # Initialize the VISA resource manager once
+        if self.rm is None:
+            import pyvisa
+            self.rm = pyvisa.ResourceManager()
 
         # Open connection to power supply, do nothing if already opened
         try:
-            self.ps = rm.open_resource(visa_resource)
+            with self.profiler.span('visa_connect', visa_resource):
+                self.ps = self.rm.open_resource(visa_resource)
             # The resource was successfully opened  
-        except pyvisa.errors.VisaIOError as e:
+        except Exception as e:
+            if not is_visa_io_error(e):
+                raise e
             if "resource is already open" in str(e):
                 print("Power supply connection already opened")
             else:
@@ -79,27 +196,35 @@ class kn57psu_controller:
                 raise e
     
     def close_resource(self):
-        self.ps.close()
+        if self.ps is not None:
+            self.ps.close()
+            self.ps = None
+        self.output_enabled = False
 
     def enable_output(self):
-        response = self.ps.query('OUTP?')  # Query the output state
+        # Output stays on between steps during a session, skip the OUTP? round trip
+        if self.session_active and self.output_enabled:
+            return
+        response = self.scpi_query('OUTP?')  # Query the output state
         if response.strip() == '1':  # Check if the response indicates that the output is already enabled
             print("Power supply output is already enabled")
         else:
-            self.ps.write('OUTP ON')
+            self.scpi_write('OUTP ON')
             print("Power supply output turned on")
+        self.output_enabled = True
 
     def disable_output(self):
-        response = self.ps.query('OUTP?')  # Query the output state
+        response = self.scpi_query('OUTP?')  # Query the output state
         if response.strip() == '0':  # Check if the response indicates that the output is already disabled
             print("Power supply output is already disabled")
         else:
-            self.ps.write('OUTP OFF')
+            self.scpi_write('OUTP OFF')
             print("Power supply output turned off")
+        self.output_enabled = False
 
     def get_id(self):
         # Query the instrument's identification
-        identification = self.ps.query('*IDN?')
+        identification = self.scpi_query('*IDN?')
         print(f"Instrument Identification: {identification}")
         
     def set_vc_flag(self, string):
@@ -109,26 +234,112 @@ class kn57psu_controller:
             self.vc_flag = string
         else:
             print("Invalid string to change vc_flag")
+            return
+        if self.load_switch is not None:
+            self.load_switch(self.vc_flag == 'current')
     
     def set_voltage(self, voltage_setpoint):
-        self.ps.write(f'VOLT {voltage_setpoint}')
+        self.scpi_write(f'VOLT {voltage_setpoint}')
         print(f"Set Voltage: {voltage_setpoint} V")
 
+    def apply_voltage(self, voltage_setpoint):
+        # Single write without print or readback, used for timed waveform output
+        self.scpi_write(f'VOLT {voltage_setpoint}')
+
     def set_current(self, current_setpoint):
-        self.ps.write(f'CURR {current_setpoint}')
+        self.scpi_write(f'CURR {current_setpoint}')
         print(f"Set Current: {current_setpoint} A")
         
         
     def read_voltage(self):
-        voltage_actual = self.ps.query('MEAS:VOLT?')
+        voltage_actual = self.scpi_query('MEAS:VOLT?')
         print(f"Actual Voltage: {voltage_actual} V")
         return voltage_actual
 
     def read_current(self):
-        current_actual = self.ps.query('MEAS:CURR?')
+        current_actual = self.scpi_query('MEAS:CURR?')
         print(f"Actual Current: {current_actual} A")
         return current_actual
     
+    def program_setpoint(self, voltage_setpoint, current_setpoint):
+        # One message to program the setpoint and turn on the output, *OPC? waits until it is applied
+        commands = [f'VOLT {voltage_setpoint}', f'CURR {current_setpoint}']
+        if not (self.session_active and self.output_enabled):
+            commands.append('OUTP ON')
+        self.scpi_query(';:'.join(commands) + ';*OPC?')
+        self.output_enabled = True
+        print(f"Set Voltage: {voltage_setpoint} V, Set Current: {current_setpoint} A")
+
+    def read_measurements(self):
+        # One message for both readbacks and the error queue, returns (volts, amps)
+        response = self.scpi_query('MEAS:VOLT?;:MEAS:CURR?;:SYST:ERR?')
+        voltage_str, current_str, error = response.strip().split(';', 2)
+        if int(error.split(',')[0]) != 0:
+            raise psu_error(f"Power supply reported an error: {error}")
+        voltage_actual = float(voltage_str)
+        current_actual = float(current_str)
+        print(f"Actual Voltage: {voltage_actual} V, Actual Current: {current_actual} A")
+        return voltage_actual, current_actual
+
+    def read_settle_sample(self):
+        # Returns a list of (reading, tolerance) pairs that must all be stable
+        if self.vc_flag == 'current':
+            sample = [(float(self.scpi_query('MEAS:CURR?')), self.settle_c_tolerance)]
+        else:
+            sample = [(float(self.scpi_query('MEAS:VOLT?')), self.settle_v_tolerance)]
+        if self.settle_probe is not None:
+            sample.extend((float(value), self.settle_probe_tolerance) for value in self.settle_probe())
+        return sample
+
+    def is_settled(self, window):
+        # Settled when the last settle_samples readings of every channel are within tolerance
+        if len(window) < self.settle_samples:
+            return False
+        for channel in zip(*window):
+            readings = [reading for reading, tolerance in channel]
+            if max(readings) - min(readings) > channel[0][1]:
+                return False
+        return True
+
+    def wait_for_settle(self, max_delay):
+        start = self.clock.now()
+        if self.settle_mode == 'adaptive':
+            window = []
+            while self.clock.now() - start < max_delay:
+                window.append(self.read_settle_sample())
+                window = window[-self.settle_samples:]
+                if self.is_settled(window):
+                    break
+                remaining = max_delay - (self.clock.now() - start)
+                self.clock.sleep(max(0.0, min(self.settle_poll_interval, remaining)))
+        else:
+            self.clock.sleep(max_delay)
+        settle_time = self.clock.now() - start
+        self.settle_times.append((max_delay, settle_time))
+        self.profiler.record('settle', start, settle_time, detail=self.settle_mode)
+        print(f"Settled in {settle_time:.2f} s (limit {max_delay} s)")
+        return settle_time
+
+    def settle_report(self):
+        # Summary of how much wall-clock the settle mode used compared to the fixed delays
+        fixed_total = sum(max_delay for max_delay, settle_time in self.settle_times)
+        actual_total = sum(settle_time for max_delay, settle_time in self.settle_times)
+        print(f"Settle steps: {len(self.settle_times)}")
+        print(f"Total settle time: {actual_total:.1f} s (fixed delays: {fixed_total:.1f} s)")
+        print(f"Time saved: {fixed_total - actual_total:.1f} s")
+        print(f"PSU round trips: {self.round_trips}")
+        return fixed_total, actual_total
+
+    def voltage_setpoints(self):
+        # Voltage sweep setpoints, computed by index so float steps do not accumulate error
+        steps = int(round((self.max_voltage - self.start_v_value) / self.increment_v))
+        return [round(self.start_v_value + i * self.increment_v, 3) for i in range(steps + 1)]
+
+    def current_setpoints(self):
+        # Current sweep setpoints, computed by index so float steps do not accumulate error
+        steps = int(round((self.max_current - self.start_c_value) / self.increment_c))
+        return [round(self.start_c_value + i * self.increment_c, 3) for i in range(steps + 1)]
+
     def voltage_sweep_check(self):
         # Initialize the voltage inc value
         volt_inc = self.start_v_value
@@ -151,7 +362,7 @@ class kn57psu_controller:
                     self.read_current()
                     # Continue
                     volt_inc += self.increment_v
-                    time.sleep(self.v_delay)
+                    self.clock.sleep(self.v_delay)
                     retry_successful = True
             except Exception as e:
                 retry_count += 1
@@ -196,7 +407,7 @@ class kn57psu_controller:
                     # Continue
                     curr_inc += self.increment_c
                     print("Wait for Resistor to Dissipate Heat Seconds: "+str(self.c_delay))
-                    time.sleep(self.c_delay)
+                    self.clock.sleep(self.c_delay)
                     print("Continuing")
                     retry_successful = True
             except Exception as e:
@@ -221,39 +432,63 @@ class kn57psu_controller:
         # Set the maximum number of retry attempts
         retry_count = 0
         retry_successful = False
+        last_error = None
+        output = None
+        start = self.clock.now()
 
         while retry_count < self.max_retry_attempts and retry_successful == False:
             try:
                 self.connect_to_power_supply()
-                self.set_voltage(voltage_setpoint)
-                self.set_current(current_setpoint)
-                self.enable_output()
-
-                # Reads the output of the keysight psu
-                voltage_actual = self.read_voltage()
-                current_actual = self.read_current()
+                if self.batch_scpi:
+                    self.program_setpoint(voltage_setpoint, current_setpoint)
+                else:
+                    self.set_voltage(voltage_setpoint)
+                    self.set_current(current_setpoint)
+                    self.enable_output()
 
-                # Probably want to add some rounding if were using the actual measurements
                 if self.vc_flag == 'volts':
-                    output = voltage_actual
-                    time.sleep(self.v_delay)
-                    retry_successful = True
+                    self.wait_for_settle(self.v_delay)
                 elif self.vc_flag == 'current':
-                    output = current_actual
-                    print("Wait for Resistor to Dissipate Heat Seconds: "+str(self.c_delay))
-                    time.sleep(self.c_delay)
-                    print("Continuing")
-                    retry_successful = True
+                    print("Wait for Current to Settle, at most Seconds: "+str(self.c_settle_delay))
+                    self.wait_for_settle(self.c_settle_delay)
                 else:
                     print("error getting flag")
+                    continue
+
+                # Reads the output of the keysight psu once it settled, this is the readback stored with the row
+                if self.batch_scpi:
+                    voltage_actual, current_actual = self.read_measurements()
+                else:
+                    voltage_actual = self.read_voltage()
+                    current_actual = self.read_current()
+                # Probably want to add some rounding if were using the actual measurements
+                output = voltage_actual if self.vc_flag == 'volts' else current_actual
+                retry_successful = True
 
             except Exception as e:
                 retry_count += 1
+                last_error = e
                 print(f"An error occurred setting voltage and current: {e}")
+                # Transparently reopen a dropped session connection before retrying
+                if self.session_active and (is_visa_io_error(e) or not self.check_connection()):
+                    try:
+                        self.reconnect()
+                    except Exception as reconnect_error:
+                        print(f"Reconnect failed: {reconnect_error}")
                 if retry_count < self.max_retry_attempts:
                     print(f"Retrying ({retry_count}/{self.max_retry_attempts})...")
                 else:
                     print("Max retry attempts reached. Exiting.")
+
+        self.profiler.record('setpoint', start, self.clock.now() - start, retries=retry_count)
+
+        # During a session the output stays on between steps, close_session() turns it off
+        if self.session_active:
+            # The sweep must stop, otherwise it records readings for a setpoint that was never applied
+            if not retry_successful:
+                raise psu_error(f"Setpoint {voltage_setpoint} V, {current_setpoint} A not applied after "
+                                f"{retry_count} attempts: {last_error}") from last_error
+            return output
         try:
             self.connect_to_power_supply()
             self.disable_output()
@@ -263,4 +498,4 @@ class kn57psu_controller:
             self.close_resource()
             return output
         except Exception as e:
-            pass  # The variable was not defined
\ No newline at end of file
+            pass  # The variable was not defined
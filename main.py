@@ -1,108 +1,285 @@
 # Code for N76 Power supply
-print("Welcome to the Server Side Inverter Calibration Firmware (seperated files)!\n")
-
-import kpsu_controller as KPSU
-from kpsu_controller import time
-import data_manager as DM
-import particle_manager as PM
+import argparse
 import sys
+import time
+
+'''
+main
+Functionality:
+1) Command line entry point, python main.py <command> --help for the options of each command
+   volts, current, calibrate, verify, waveform, hold, plan, dry-run, export, fit,
+   archive, history, fleet
+2) Nothing runs at import, so the helpers can be imported by other tools
+3) Heavy libraries (pyvisa, numpy, requests) are only imported by the commands that need them,
+   pyvisa only on the first psu connection, export / fit never load pyvisa or requests
+
+python main.py calibrate --ip 10.10.223.99 --device-id <id> --token <token>
+python main.py export calibration_runs/run_20240101_120000
+'''
+
+def build_station(args):
+    # Initalize classes, one station is one psu + particle rig, see station_orchestrator for several
+    import calibration_station as CS
+    station = CS.calibration_station(ip_address=args.ip, device_id=args.device_id, access_token=args.token,
+                                     inverter_count=args.inverters, save_directory=args.save_directory)
+
+    # # Get Inverter count than initalize data manager
+    # inverter_num = int(station.pm.get_inverter_num())
+    # print("Number of Inverters = "+str(inverter_num))
+    # # If no inverters connect abort
+    # if inverter_num <= 0:
+    #     sys.exit()
+
+    # Continue as soon as the psu readings are stable, v_delay / c_settle_delay stay the upper bound
+    station.kpsu.settle_mode = args.settle
+    # Also wait for the inverter readings to be stable, voltages in the voltage sweep and currents in the current sweep
+    station.settle_on_inverters = args.settle_probe
+    # Take readings from the published "voltages" / "currents" events instead of calling the
+    # cloud functions every step, needs firmware that publishes its readings
+    station.ingest_mode = args.ingest
+    # Average several readings per setpoint with outlier rejection, the std is saved next to each reading
+    station.samples_per_setpoint = args.samples
+    # Fitted coefficients by inverter id, shared by every station that re-tests the same units
+    station.cache_file = args.cache
+    # Also keep every run in the SQLite archive
+    station.dm.database_file = args.database
+    return station
+
+
+def full_voltage_sweep(args):
+    station = build_station(args)
+    if args.resume is not None:
+        station.dm.run_dir = args.resume
+    if args.adaptive:
+        station.adaptive_voltage_sweep(args.resume is not None)
+    else:
+        station.full_voltage_sweep(args.resume is not None)
+    station.dm.save_to_database()
+    station.dm.finish_streams()
+
+
+def full_current_sweep(args):
+    station = build_station(args)
+    if args.resume is not None:
+        station.dm.run_dir = args.resume
+    if args.adaptive:
+        station.adaptive_current_sweep(args.resume is not None)
+    else:
+        station.full_current_sweep(args.resume is not None)
+    station.dm.save_to_database()
+    station.dm.finish_streams()
+
+
+def get_calibration(args):
+    # Pass the run directory of a crashed run to resume it
+    station = build_station(args)
+    return 0 if station.get_calibration(args.resume, args.adaptive, args.combined) else 1
+
 
-# Initalize classes
-kpsu = KPSU.kn57psu_controller()
-pm = PM.particle_manager()
-
-# # Get Inverter count than initalize data manager
-# inverter_num = int(pm.get_inverter_num())
-# print("Number of Inverters = "+str(inverter_num))
-# # If no inverters connect abort
-# if inverter_num <= 0:
-#     sys.exit()
-
-dm = DM.data_manager(3)
-
-
-def full_voltage_sweep():
-    kpsu.set_vc_flag('volts')
-    volt_inc = kpsu.start_v_value
-    while volt_inc <= kpsu.max_voltage:
-        try:
-            kpsu.control_power_supply(voltage_setpoint=volt_inc, current_setpoint=kpsu.stable_curr)
-            measured_voltages = pm.get_measured_voltages()
-            measured_voltages.insert(0, volt_inc)
-            dm.append_voltages(measured_voltages)
-            volt_inc += kpsu.increment_v
-        except Exception as e: 
-            print(f"An unexpected voltage sweep error occurred:")
-            raise e
-    dm.voltages_to_csv()
-    # turn off psu
-    kpsu.control_power_supply(voltage_setpoint=0, current_setpoint=0)
-    time.sleep(10)
-    print("Finished Voltage Measurements")
-
-def voltage_sign_wave():
-    direction = 1
-    kpsu.set_vc_flag('volts')
-    volt_inc = kpsu.start_v_value
-    while True:
-        try:
-            kpsu.control_power_supply(voltage_setpoint=volt_inc, current_setpoint=kpsu.max_current)
-            volt_inc += kpsu.increment_v * direction
-            # Code for sign wave
-            if volt_inc >= kpsu.max_voltage:
-                volt_inc = kpsu.max_voltage
-                direction = -1  # Change direction to decrement
-            elif volt_inc <= kpsu.start_v_value:
-                volt_inc = kpsu.start_v_value
-                direction = 1  # Change direction to increment
-    
-        except Exception as e: 
-            print(f"An unexpected voltage signwave error occurred:")
-            raise e
-    # turn off psu
-    kpsu.control_power_supply(voltage_setpoint=0, current_setpoint=0)
-    time.sleep(10)
-    print("Finished Voltage sign wave")
-
-def full_current_sweep():
-    kpsu.set_vc_flag('current')
-    curr_inc = kpsu.start_c_value
-    while curr_inc <= kpsu.max_current:
-        try:
-            # New current setting method see kpsu attributes for more details
-            V = kpsu.c_factor * curr_inc
-            rounded_V = round(V, 3)
-            kpsu.control_power_supply(voltage_setpoint=rounded_V, current_setpoint=kpsu.max_current)
-            measured_currents = pm.get_measured_currents()
-            measured_currents.insert(0, curr_inc)
-            dm.append_currents(measured_currents)
-            curr_inc += kpsu.increment_c
-        except Exception as e:  
-            print(f"An unexpected current sweep error occurred:")
-            raise e
-    dm.currents_to_csv()
-    # turn off psu
-    kpsu.control_power_supply(voltage_setpoint=0, current_setpoint=0)
-    time.sleep(10)
-    print("Finished Current Measurements")
-        
-        
-def get_calibration():
+def quick_calibration(args):
+    # Re-test: short verification sweep against the cached calibration, full calibration only when needed
+    station = build_station(args)
+    return 0 if station.quick_calibration(args.adaptive, args.combined) else 1
+
+
+def voltage_sign_wave(args):
+    station = build_station(args)
+    station.voltage_sign_wave(args.shape, args.frequency, args.sample_rate, args.cycles, args.duration)
+
+
+def hold_current(args):
+    # max voltage = 39.92016 fr current at 10amps with 2k resistor paraellel
+    station = build_station(args)
+    kpsu, pm = station.kpsu, station.pm
+    station.set_sweep('current')
+    # Outside a session control_power_supply turns the output off again, leaving the with block does
+    with kpsu:
+        kpsu.control_power_supply(voltage_setpoint=args.voltage, current_setpoint=kpsu.max_current)
+        for i in range(0, args.repeats):
+            pm.get_measured_currents()
+            print("Wait for Resistor to Dissipate Heat Seconds: "+str(args.wait))
+            station.clock.sleep(args.wait)
+            print("Continuing")
+
+
+def show_plan(args):
+    # Setpoint grids and the thermal current plan with the step durations of a station, nothing is
+    # powered or called, the station is only built to use the same heat duration and planner
+    import calibration_station as CS
+    station = CS.calibration_station(inverter_count=args.inverters)
+    station.ingest_mode = args.ingest
+    station.samples_per_setpoint = args.samples
+    kpsu, thermal = station.kpsu, station.thermal
+    planner = station.sweep_planner()
+    v_setpoints = kpsu.voltage_setpoints()
+    c_setpoints = kpsu.current_setpoints()
     try:
-        full_voltage_sweep()
-        full_current_sweep()
-        print("Calibration complete")
-    except ConnectionError:  # Catch the connection error
-        return
-    except Exception as e:  
-        return
-
-# voltage_sign_wave()
-
-# max voltage = 39.92016 fr current at 10amps with 2k resistor paraellel 
-kpsu.control_power_supply(voltage_setpoint=39.92016, current_setpoint=kpsu.max_current)
-for i in range(0,5):
-    pm.get_measured_currents()
-    print("Wait for Resistor to Dissipate Heat Seconds: "+str(120))
-    time.sleep(120)
-    print("Continuing")
\ No newline at end of file
+        plan = thermal.plan_current_sweep(c_setpoints, station.current_heat_duration())
+    except ValueError as e:
+        print(f"No safe current plan: {e}")
+        return 1
+    cooldown = sum(dwell for setpoint, dwell in plan)
+    voltage_time = len(v_setpoints) * planner.v_duration
+    current_time = len(plan) * planner.c_duration + cooldown
+    print(f"Voltage sweep: {len(v_setpoints)} setpoints {v_setpoints[0]} - {v_setpoints[-1]} V, "
+          f"about {voltage_time / 60:.1f} min")
+    print(f"Current sweep: {len(c_setpoints)} setpoints {c_setpoints[0]} - {c_setpoints[-1]} A, "
+          f"about {current_time / 60:.1f} min ({cooldown:.0f} s cooldown)")
+    print("Order: " + ", ".join(f"{setpoint} A" + (f" (+{dwell:.0f} s)" if dwell else "") for setpoint, dwell in plan))
+    planner.plan(v_setpoints, c_setpoints)
+    print(f"Combined sweep: about {planner.estimate / 60:.1f} min")
+    print(f"Particle reads counted as {station.read_time_estimate} s per step, see dry-run for a full estimate")
+
+
+def dry_run(args):
+    import dry_run as DR
+    DR.dry_run(args.inverters, args.settle, adaptive=args.adaptive, verbose=args.verbose, combined=args.combined)
+
+
+def export_run_csv(args):
+    # CSV is only written on demand from a saved run
+    import data_manager as DM
+    DM.load_run(args.run_dir).export_csv()
+
+
+def fit_calibration(args):
+    import data_manager as DM
+    import calibration_fit as CF
+    CF.fit_run(DM.load_run(args.run_dir), args.degree, args.breakpoints)
+
+
+def archive_runs(args):
+    # Add saved run directories to the SQLite archive, fitting them so they show up in the drift queries
+    import data_manager as DM
+    import calibration_fit as CF
+    for run_dir in args.run_dirs:
+        dm = DM.load_run(run_dir)
+        dm.database_file = args.database
+        voltage_fit, current_fit = CF.fit_run(dm)
+        dm.save_to_database(args.inverter_ids, voltage_fit, current_fit)
+
+
+def inverter_history(args):
+    import run_database as RD
+    with RD.run_database(args.database) as database:
+        history = database.inverter_history(args.inverter_id, args.sweep)
+    print(f"{'Run':>6}  {'Station':<12}{'Saved':<21}{'Gain':>12}{'Offset':>12}{'RMS':>12}")
+    for row in history:
+        saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row['saved']))
+        print(f"{row['run_id']:>6}  {str(row['station']):<12}{saved:<21}{row['gain']:>12.6f}"
+              f"{row['offset']:>12.6f}{row['rms_error']:>12.6f}")
+
+
+def fleet_stats(args):
+    import run_database as RD
+    with RD.run_database(args.database) as database:
+        stats = database.fleet_stats(args.sweep, args.last, args.station)
+    for name, value in stats.items():
+        print(f"{name}: {value}")
+
+
+def add_station_arguments(parser):
+    parser.add_argument('--ip', help="psu ip address")
+    parser.add_argument('--device-id', help="particle device id")
+    parser.add_argument('--token', help="particle access token")
+    parser.add_argument('--inverters', type=int, default=3)
+    parser.add_argument('--save-directory', help="runs are saved under this directory")
+    parser.add_argument('--settle', choices=['fixed', 'adaptive'], default='fixed')
+    parser.add_argument('--settle-probe', action='store_true', help="also wait for stable inverter readings")
+    parser.add_argument('--ingest', choices=['poll', 'stream'], default='poll')
+    parser.add_argument('--samples', type=int, default=1, help="readings averaged per setpoint")
+    parser.add_argument('--cache', help="calibration cache file, default <save directory>/calibration_cache.json")
+    parser.add_argument('--database', help="SQLite archive every run is also stored in")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Server side inverter calibration")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, function, help_text in (('volts', full_voltage_sweep, "voltage sweep"),
+                                      ('current', full_current_sweep, "current sweep"),
+                                      ('calibrate', get_calibration, "voltage and current sweep plus fit")):
+        command = commands.add_parser(name, help=help_text)
+        add_station_arguments(command)
+        command.add_argument('--resume', metavar='RUN_DIR', help="resume a crashed run")
+        command.add_argument('--adaptive', action='store_true', help="only refine where the fit needs it")
+        command.set_defaults(function=function)
+    commands.choices['calibrate'].add_argument('--combined', action='store_true',
+                                               help="one schedule for both sweeps, voltage steps fill the cooldowns")
+
+    command = commands.add_parser('verify', help="verify the cached calibration, full calibration if out of tolerance")
+    add_station_arguments(command)
+    command.add_argument('--adaptive', action='store_true', help="adaptive sweeps for the full calibration")
+    command.add_argument('--combined', action='store_true', help="combined schedule for the full calibration")
+    command.set_defaults(function=quick_calibration)
+
+    command = commands.add_parser('waveform', help="deadline scheduled voltage waveform")
+    add_station_arguments(command)
+    command.add_argument('--shape', choices=['triangle', 'sine', 'step'], default='triangle')
+    command.add_argument('--frequency', type=float, help="Hz, default one sweep up and down")
+    command.add_argument('--sample-rate', type=float, help="setpoints per second, default 1 / v_delay")
+    command.add_argument('--cycles', type=int, default=1)
+    command.add_argument('--duration', type=float, help="seconds, overrides --cycles")
+    command.set_defaults(function=voltage_sign_wave)
+
+    command = commands.add_parser('hold', help="hold max current and read the inverter currents")
+    add_station_arguments(command)
+    command.add_argument('--voltage', type=float, default=39.92016)
+    command.add_argument('--repeats', type=int, default=5)
+    command.add_argument('--wait', type=float, default=120)
+    command.set_defaults(function=hold_current)
+
+    command = commands.add_parser('plan', help="show the setpoints and thermal plan")
+    command.add_argument('--inverters', type=int, default=3)
+    command.add_argument('--ingest', choices=['poll', 'stream'], default='poll')
+    command.add_argument('--samples', type=int, default=1, help="readings averaged per setpoint")
+    command.set_defaults(function=show_plan)
+
+    command = commands.add_parser('dry-run', help="estimate the run time on simulated hardware")
+    command.add_argument('--inverters', type=int, default=3)
+    command.add_argument('--settle', choices=['fixed', 'adaptive'], default='fixed')
+    command.add_argument('--adaptive', action='store_true')
+    command.add_argument('--combined', action='store_true')
+    command.add_argument('--verbose', action='store_true')
+    command.set_defaults(function=dry_run)
+
+    command = commands.add_parser('export', help="write the csv files of a saved run")
+    command.add_argument('run_dir')
+    command.set_defaults(function=export_run_csv)
+
+    command = commands.add_parser('fit', help="fit calibration coefficients of a saved run")
+    command.add_argument('run_dir')
+    command.add_argument('--degree', type=int, default=1)
+    command.add_argument('--breakpoints', type=float, nargs='*')
+    command.set_defaults(function=fit_calibration)
+
+    command = commands.add_parser('archive', help="store saved runs in the SQLite archive")
+    command.add_argument('database')
+    command.add_argument('run_dirs', nargs='+')
+    command.add_argument('--inverter-ids', nargs='*', help="ids of the inverters in measurement order")
+    command.set_defaults(function=archive_runs)
+
+    command = commands.add_parser('history', help="calibration history of one inverter")
+    command.add_argument('database')
+    command.add_argument('inverter_id')
+    command.add_argument('--sweep', choices=['volts', 'current'], default='volts')
+    command.set_defaults(function=inverter_history)
+
+    command = commands.add_parser('fleet', help="gain / offset statistics over the archived runs")
+    command.add_argument('database')
+    command.add_argument('--sweep', choices=['volts', 'current'], default='volts')
+    command.add_argument('--last', type=int, help="only the last N runs")
+    command.add_argument('--station')
+    command.set_defaults(function=fleet_stats)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command not in ('plan', 'export', 'fit', 'archive', 'history', 'fleet'):
+        print("Welcome to the Server Side Inverter Calibration Firmware (seperated files)!\n")
+    return args.function(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# Import other libraries
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+import requests
+import sweep_clock as SC
+import particle_manager as PM
+
+'''
+particle event stream class
+Functionality:
+1) Alternative to polling getVoltages / getCurrents, subscribes to the server sent events stream
+   of the device (GET /v1/devices/<device id>/events/<prefix>) on one background thread
+2) The device firmware publishes its readings as "voltages" / "currents" events, every event is
+   buffered with its published_at timestamp
+3) reading_after(event, t) returns the first reading published after t, the sweep passes the time
+   the psu settled so it never uses a reading taken on the previous setpoint, readings_after(event, t, n)
+   the first n for multi sample sweeps
+4) Reconnects with the particle_manager backoff when the stream drops
+5) published_at is stamped by the particle cloud and compared with the host clock, so the host must be
+   NTP synced. received - published is tracked per event, a host clock behind the cloud by more than
+   max_clock_skew would accept readings of the previous setpoint and is warned about
+'''
+
+def parse_published_at(published_at):
+    # "2024-01-01T12:00:00.123Z" -> unix time, None when missing or malformed
+    try:
+        return datetime.fromisoformat(published_at.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class particle_event_stream:
+    # config values
+    volt_event = "voltages"
+    curr_event = "currents"
+    # Only events starting with this prefix are sent, "" for every event of the device
+    event_prefix = ""
+    # Events kept per name, older ones are dropped
+    buffer_size = 256
+    # Seconds without any data (the cloud sends keep alives) before the stream is reopened
+    stream_timeout = 60
+    # Seconds the host clock may be behind the cloud clock before the readings are not trusted
+    max_clock_skew = 0.5
+
+    def __init__(self, pm, clock=None):
+        # Uses the device, token, session and retry settings of the particle_manager
+        self.pm = pm
+        self.clock = clock if clock is not None else SC.system_clock()
+        self.buffers = {}
+        self.condition = threading.Condition()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.response = None
+        self.reconnects = 0
+        # Seconds from publish to arrival, by event name
+        self.latencies = {}
+        # Smallest received - published seen, network delay plus host clock offset to the cloud
+        self.clock_offset = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def stream_url(self):
+        url = f"{self.pm.url}/{self.pm.device_id}/events"
+        return f"{url}/{self.event_prefix}" if self.event_prefix else url
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            print("Particle event stream started")
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        # Closing the response unblocks the reader thread
+        response = self.response
+        if response is not None:
+            response.close()
+        self.thread.join(timeout=self.pm.timeout[0])
+        self.thread = None
+        with self.condition:
+            self.condition.notify_all()
+        print("Particle event stream stopped")
+
+    def run(self):
+        attempt = 0
+        while not self.stopping.is_set():
+            try:
+                self.response = self.pm.session.get(self.stream_url(), params={"access_token": self.pm.access_token},
+                                                    stream=True, timeout=(self.pm.timeout[0], self.stream_timeout))
+                if self.response.status_code != 200:
+                    raise PM.particle_error(f"Error: {self.response.status_code}")
+                attempt = 0
+                self.read_stream(self.response)
+            except (requests.RequestException, PM.particle_error, AttributeError, ValueError) as e:
+                # AttributeError / ValueError come from reading a response that stop() closed
+                if self.stopping.is_set():
+                    break
+                attempt += 1
+                print(f"Particle event stream dropped ({e}), reconnecting")
+            finally:
+                if self.response is not None:
+                    self.response.close()
+                    self.response = None
+            if not self.stopping.is_set():
+                self.reconnects += 1
+                self.stopping.wait(self.pm.backoff_delay(max(1, attempt)))
+
+    def read_stream(self, response):
+        # text/event-stream: "event: <name>" and "data: <json>" lines, a blank line ends an event
+        name, data = None, []
+        # chunk_size None hands over data as it arrives instead of waiting for a full 512 byte chunk
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if self.stopping.is_set():
+                return
+            if not line:
+                if name is not None and data:
+                    self.add_event(name, "\n".join(data))
+                name, data = None, []
+            elif line.startswith("event:"):
+                name = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data:"):].strip())
+            # Lines starting with ":" are keep alives
+        raise PM.particle_error("Stream closed by the cloud")
+
+    def add_event(self, name, data):
+        received = self.clock.wall_time()
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            payload = {"data": data}
+        published = parse_published_at(payload.get("published_at"))
+        timestamp = published if published is not None else received
+        readings = self.pm.parse_readings(str(payload.get("data", "")))
+        with self.condition:
+            self.buffers.setdefault(name, deque(maxlen=self.buffer_size)).append((timestamp, readings))
+            self.latencies.setdefault(name, []).append(received - timestamp)
+            self.condition.notify_all()
+        if published is not None:
+            self.check_clock_offset(received - published)
+
+    def check_clock_offset(self, delay):
+        # An event can not arrive before it was published, a negative delay is the host clock running behind
+        if self.clock_offset is not None and delay >= self.clock_offset:
+            return
+        self.clock_offset = delay
+        if delay < -self.max_clock_skew:
+            print(f"WARNING: host clock is {-delay:.3f} s behind the particle cloud, sync it with NTP, "
+                  f"readings of the previous setpoint can be taken for the current one")
+
+    def find_after(self, name, after, count):
+        found = [readings for timestamp, readings in self.buffers.get(name, ()) if timestamp > after]
+        return found[:count]
+
+    def readings_after(self, name, after, count=1, timeout=None):
+        # First count readings of the event published after the unix time after
+        # Waits up to timeout seconds per reading
+        timeout = (timeout if timeout is not None else self.pm.timeout[1]) * count
+        self.start()
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.find_after(name, after, count)) >= count or self.stopping.is_set(), timeout)
+            found = self.find_after(name, after, count)
+        if len(found) < count:
+            raise PM.particle_error(f"Only {len(found)} of {count} {name} events published within {timeout} s")
+        return [list(readings) for readings in found]
+
+    def reading_after(self, name, after, timeout=None):
+        return self.readings_after(name, after, 1, timeout)[0]
+
+    def get_measured_voltages(self, after):
+        print("Waiting for Voltages event from Inverters")
+        result_list = self.reading_after(self.volt_event, after)
+        print("Event Received Result: "+str(result_list))
+        return result_list
+
+    def get_measured_currents(self, after):
+        print("Waiting for Currents event from Inverters")
+        result_list = self.reading_after(self.curr_event, after)
+        print("Event Received Result: "+str(result_list))
+        return result_list
+
+    def latency_report(self):
+        for name, latencies in self.latencies.items():
+            mean = sum(latencies) / len(latencies)
+            print(f"{name} events: {len(latencies)} received, mean delay {mean:.3f} s, "
+                  f"max {max(latencies):.3f} s, reconnects {self.reconnects}")
+        if self.clock_offset is not None:
+            print(f"Smallest publish to arrival delay {self.clock_offset:.3f} s (host clock offset included)")
@@ -1,15 +1,35 @@
+import random
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import Timeout
+import sweep_clock as SC
+import step_profiler as SP
 '''
 Particle manager class
 Functionality:
 1) Contains code that interfaces with the particle controller to get voltage and current measurements
 2) Interfaces with the particle controller to switch inverter boards and gain info on total amount and which one is currently being measured
-2) This class also utilizes import delay mechanism 
+2) This class also utilizes import delay mechanism
+3) All cloud calls go through call_function() on one keep-alive session with retries and latency tracking
 '''
+
+class particle_error(Exception):
+    # Raised when a cloud call still fails after all retries
+    pass
+
 class particle_manager:
+    # config values
+    max_retry_attempts = 3
+    # Exponential backoff with jitter between retries, in seconds
+    backoff_base = 0.5
+    backoff_max = 8.0
+    # Connections kept open to the particle cloud
+    pool_size = 4
 
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else SC.system_clock()
+        # Timing of every HTTP attempt and parse, enabled by calibration_station
+        self.profiler = SP.step_profiler(self.clock, enabled=False)
         self.url = "https://api.particle.io/v1/devices"
         self.device_id = ""
         self.access_token = ""
@@ -17,74 +37,109 @@ class particle_manager:
         self.volt_call = "getVoltages"
         self.curr_call = "getCurrents"
         self.inverter_num_call = "getInverterCount"
+        self.inverter_ids_call = "getInverterIds"
 
         #5 seconds for connection 5 seconds for response
         self.timeout = (5, 20)
-    
+
+        # One pooled keep-alive session so each measurement reuses a warm connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Seconds per successful call and retries used, by cloud function name
+        self.latencies = {}
+        self.retry_counts = {}
+
+    def close(self):
+        self.session.close()
+
+    def backoff_delay(self, attempt):
+        # Full jitter, random wait up to base * 2^(attempt - 1)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def call_function(self, function_name):
+        # Returns the raw result string of a cloud function, raises particle_error after all retries
+        full_url = f"{self.url}/{self.device_id}/{function_name}"
+        params = {"access_token": self.access_token}
+        error = None
+
+        for attempt in range(1, self.max_retry_attempts + 1):
+            start = self.clock.now()
+            try:
+                # Make the GET request with the specified timeout
+                try:
+                    response = self.session.get(full_url, params=params, timeout=self.timeout)
+                finally:
+                    self.profiler.record('particle_http', start, self.clock.now() - start,
+                                         retries=attempt - 1, detail=function_name)
+
+                # Check if the request was successful (status code 200)
+                if response.status_code == 200:
+                    result_str = response.json()["result"]
+                    self.latencies.setdefault(function_name, []).append(self.clock.now() - start)
+                    self.retry_counts[function_name] = self.retry_counts.get(function_name, 0) + attempt - 1
+                    return result_str
+                error = f"Error: {response.status_code} {response.text}"
+                # Client errors other than rate limiting will not fix themselves
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    break
+
+            except Timeout:
+                error = "Request timed out."
+            except (requests.RequestException, ValueError, KeyError) as e:
+                error = f"An error occurred: {e}"
+
+            print(f"{function_name} failed ({attempt}/{self.max_retry_attempts}): {error}")
+            if attempt < self.max_retry_attempts:
+                self.clock.sleep(self.backoff_delay(attempt))
+
+        raise particle_error(f"{function_name} failed: {error}")
+
+    def parse_readings(self, result_str):
+        # "1.23, 4.56, ..." -> [1.23, 4.56, ...], channels that are not numbers become nan
+        readings = []
+        with self.profiler.span('parse'):
+            for value in result_str.split(","):
+                try:
+                    readings.append(float(value))
+                except ValueError:
+                    readings.append(float("nan"))
+        return readings
+
     def get_measured_voltages(self):
         print("Getting Voltages from Inverters")
-        full_url = f"{ self.url}/{self.device_id}/{self.volt_call}?access_token={self.access_token}"
-
-        try:
-            # Make the GET request with the specified timeout
-            response = requests.get(full_url, timeout=self.timeout)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code == 200:
-                result_str = response.json()["result"]
-                result_list = result_str.split(", ")
-                print("Connection Successful Result: "+str(result_list))
-                return result_list
-            else:
-                print("Error:", response.status_code, response.text)
-
-        except Timeout:
-            print("Request timed out.")
-        except Exception as e:
-            print("An error occurred:", e)
+        result_list = self.parse_readings(self.call_function(self.volt_call))
+        print("Connection Successful Result: "+str(result_list))
+        return result_list
 
     def get_measured_currents(self):
         print("Getting Currents from Inverters")
-        full_url = f"{ self.url}/{self.device_id}/{self.curr_call}?access_token={self.access_token}"
-
-        try:
-            # Make the GET request with the specified timeout
-            response = requests.get(full_url, timeout=self.timeout)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code == 200:
-                result_str = response.json()["result"]
-                result_list = result_str.split(", ")
-                print("Connection Successful Result: "+str(result_list))
-                return result_list
-            else:
-                print("Error:", response.status_code, response.text)
-
-        except Timeout:
-            print("Request timed out.")
-        except Exception as e:
-            print("An error occurred:", e)
+        result_list = self.parse_readings(self.call_function(self.curr_call))
+        print("Connection Successful Result: "+str(result_list))
+        return result_list
 
     def get_inverter_num(self):
         print("Getting number of Inverters")
-        full_url = f"{ self.url}/{self.device_id}/{self.inverter_num_call}?access_token={self.access_token}"
-        try:
-            # Make the GET request with the specified timeout
-            response = requests.get(full_url, timeout=self.timeout)
-
-            # Check if the request was successful (status code 200)
-            if response.status_code == 200:
-                result_str = response.json()["result"]
-                result_list = result_str.split(", ")
-                print("Connection Successful")
-                return result_list[0]
-            else:
-                print("Error:", response.status_code, response.text)
-
-        except Timeout:
-            print("Request timed out.")
-        except Exception as e:
-            print("An error occurred:", e)
+        result_str = self.call_function(self.inverter_num_call)
+        print("Connection Successful")
+        return int(result_str.split(",")[0])
+
+    def get_inverter_ids(self):
+        # Serial / id of every inverter in measurement order, used to key the calibration cache
+        print("Getting Inverter ids")
+        result_str = self.call_function(self.inverter_ids_call)
+        inverter_ids = [inverter_id.strip() for inverter_id in result_str.split(",") if inverter_id.strip()]
+        print("Connection Successful Result: "+str(inverter_ids))
+        return inverter_ids
+
+    def latency_report(self):
+        # Count, mean and max latency per cloud function
+        for function_name, latencies in self.latencies.items():
+            mean = sum(latencies) / len(latencies)
+            print(f"{function_name}: {len(latencies)} calls, mean {mean:.3f} s, max {max(latencies):.3f} s, "
+                  f"retries {self.retry_counts.get(function_name, 0)}")
 
     # TODO!
 
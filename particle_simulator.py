@@ -0,0 +1,163 @@
+# Import other libraries
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+'''
+particle simulator class
+Functionality:
+1) Local HTTP stand in for the particle cloud functions used by particle_manager
+   (getVoltages, getCurrents, getInverterCount, getInverterIds)
+2) The inverters measure the simulated power supply output, each with its own gain/offset error
+3) Point particle_manager at it with pm.url = simulator.url
+4) local_call() answers in process on the supply clock for virtual time dry runs,
+   ex. pm.call_function = simulator.local_call
+5) /v1/devices/<device id>/events is a server sent events stand in that publishes "voltages" and
+   "currents" events every publish_interval, for particle_events.particle_event_stream
+'''
+
+class particle_simulator:
+    # config values
+    # Seconds of cloud round trip added to every request
+    latency = 0.01
+    # Standard deviation of the inverter measurement noise
+    noise = 0.001
+    # Seconds between published measurement events on the event stream
+    publish_interval = 0.05
+
+    def __init__(self, supply, inverter_count=3, seed=0):
+        # supply is a psu_simulator.simulated_power_supply
+        self.supply = supply
+        self.inverter_count = inverter_count
+        generator = random.Random(seed)
+        # Per inverter measurement error the calibration should find
+        self.gains = [generator.uniform(0.95, 1.05) for i in range(inverter_count)]
+        self.offsets = [generator.uniform(-0.05, 0.05) for i in range(inverter_count)]
+        self.inverter_ids = [f"SIM{seed:03d}-{i + 1}" for i in range(inverter_count)]
+        self.requests = 0
+        self.server = None
+        self.thread = None
+        self.streaming = threading.Event()
+
+    def readings(self, value):
+        return ", ".join(f"{gain * value + offset + random.gauss(0.0, self.noise):.5f}"
+                         for gain, offset in zip(self.gains, self.offsets))
+
+    def result(self, function_name):
+        # Result string of a cloud function, None for unknown functions
+        if function_name == "getVoltages":
+            return self.readings(self.supply.output_voltage())
+        if function_name == "getCurrents":
+            return self.readings(self.supply.measure_current())
+        if function_name == "getInverterCount":
+            return str(self.inverter_count)
+        if function_name == "getInverterIds":
+            return ", ".join(self.inverter_ids)
+        return None
+
+    def event(self, name, function_name):
+        # Server sent event in the particle cloud format, published_at in milliseconds
+        published_at = datetime.fromtimestamp(self.supply.clock.wall_time(), timezone.utc)
+        payload = {"data": self.result(function_name), "ttl": 60, "coreid": "simulator",
+                   "published_at": published_at.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'}
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode()
+
+    def local_call(self, function_name):
+        # Same results without HTTP, the latency is spent on the supply clock
+        self.requests += 1
+        self.supply.clock.sleep(self.latency)
+        result = self.result(function_name)
+        if result is None:
+            raise ValueError(f"Function not found: {function_name}")
+        return result
+
+    def start(self):
+        simulator = self
+
+        class handler(BaseHTTPRequestHandler):
+            # Keep-alive so the pooled particle_manager session is exercised like the real cloud
+            protocol_version = "HTTP/1.1"
+            # Send headers and body in one packet, otherwise nagle adds ~40 ms per request
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if '/events' in urlparse(self.path).path:
+                    self.stream_events()
+                    return
+                simulator.requests += 1
+                time.sleep(simulator.latency)
+                # /v1/devices/<device id>/<function>
+                function_name = urlparse(self.path).path.rstrip('/').split('/')[-1]
+                result = simulator.result(function_name)
+                if result is None:
+                    self.send_response(404)
+                    body = json.dumps({"ok": False, "error": "Function not found"}).encode()
+                else:
+                    self.send_response(200)
+                    body = json.dumps({"result": result}).encode()
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle(self):
+                # A stream client hanging up is the normal way an event stream ends
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def finish(self):
+                try:
+                    super().finish()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def stream_events(self):
+                # One event per reading, like firmware calling Particle.publish in its loop
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                # Chunked like the real cloud, every event reaches the client as soon as it is sent
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    self.write_chunk(b":ok\n\n")
+                    while simulator.streaming.is_set():
+                        for name, function_name in (("voltages", "getVoltages"), ("currents", "getCurrents")):
+                            self.write_chunk(simulator.event(name, function_name))
+                        time.sleep(simulator.publish_interval)
+                    self.write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def write_chunk(self, data):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass  # Keep the sweep output readable
+
+        self.streaming.set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/v1/devices"
+
+    def stop(self):
+        self.streaming.clear()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,140 @@
+# Import other libraries
+import math
+import random
+import threading
+import sweep_clock as SC
+
+'''
+power supply simulator class
+Functionality:
+1) In process stand in for the keysight N5767A that answers the SCPI used by kn57psu_controller
+2) Chained messages (VOLT 1;:CURR 2;*OPC?) are split and handled like the real supply
+3) The output follows the setpoint with first order settling into the 100/27 ohm test load,
+   switching to constant current when the load asks for more than the current limit, the load
+   is only connected for the current sweep (connect_load, ex. kpsu.load_switch = supply.connect_load)
+4) Every write or query waits a configurable latency and is counted as a round trip
+   (on the given clock, so a virtual_clock run simulates the latency without waiting)
+5) simulated_resource_manager replaces pyvisa.ResourceManager, ex. kpsu.rm = simulated_resource_manager()
+'''
+
+class simulated_power_supply:
+    # config values
+    # Seconds per write or query, a LAN round trip
+    latency = 0.002
+    # Seconds for the output to reach 63% of a new setpoint
+    settle_time_constant = 0.05
+    # Standard deviation of the measurement noise
+    noise = 0.0005
+    # Load on the output, see kn57psu_controller.c_factor, None for an open output
+    load_resistance = 100.0 / 27.0
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else SC.system_clock()
+        self.lock = threading.Lock()
+        self.voltage_setpoint = 0.0
+        self.current_setpoint = 0.0
+        self.output = False
+        # The test load is switched in for the current sweep, the voltage sweep runs open
+        self.load_connected = True
+        self.errors = []
+        self.round_trips = 0
+        # Output voltage when the last change happened and when it happened
+        self.start_voltage = 0.0
+        self.change_time = self.clock.now()
+
+    def connect_load(self, connected):
+        with self.lock:
+            self.change_setting()
+            self.load_connected = connected
+
+    def load(self):
+        # Resistance on the output right now, None when open
+        return self.load_resistance if self.load_connected else None
+
+    def target_voltage(self):
+        if not self.output:
+            return 0.0
+        if self.load() is None:
+            return self.voltage_setpoint
+        # Constant current once the load would draw more than the limit
+        return min(self.voltage_setpoint, self.current_setpoint * self.load())
+
+    def output_voltage(self):
+        elapsed = self.clock.now() - self.change_time
+        target = self.target_voltage()
+        return target + (self.start_voltage - target) * math.exp(-elapsed / self.settle_time_constant)
+
+    def change_setting(self):
+        # Settling starts again from wherever the output is right now
+        self.start_voltage = self.output_voltage()
+        self.change_time = self.clock.now()
+
+    def measure_voltage(self):
+        return self.output_voltage() + random.gauss(0.0, self.noise)
+
+    def measure_current(self):
+        if self.load() is None:
+            return random.gauss(0.0, self.noise)
+        return self.output_voltage() / self.load() + random.gauss(0.0, self.noise)
+
+    def handle(self, command):
+        # Returns the response of one command, None for commands without a response
+        command = command.strip().lstrip(':').upper()
+        if command == '*OPC?':
+            return '1'
+        if command == '*IDN?':
+            return 'Keysight Technologies,N5767A,SIMULATED,1.0'
+        if command == 'OUTP?':
+            return '1' if self.output else '0'
+        if command == 'MEAS:VOLT?':
+            return f'{self.measure_voltage():.6f}'
+        if command == 'MEAS:CURR?':
+            return f'{self.measure_current():.6f}'
+        if command == 'SYST:ERR?':
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        name, _, value = command.partition(' ')
+        try:
+            if name == 'VOLT':
+                self.change_setting()
+                self.voltage_setpoint = float(value)
+            elif name == 'CURR':
+                self.change_setting()
+                self.current_setpoint = float(value)
+            elif name == 'OUTP':
+                self.change_setting()
+                self.output = value in ('ON', '1')
+            else:
+                self.errors.append('-113,"Undefined header"')
+        except ValueError:
+            self.errors.append('-222,"Data out of range"')
+        return None
+
+    def message(self, message):
+        with self.lock:
+            self.round_trips += 1
+            self.clock.sleep(self.latency)
+            responses = [self.handle(command) for command in message.split(';')]
+            return ';'.join(response for response in responses if response is not None)
+
+    # pyvisa resource interface
+    def write(self, message):
+        self.message(message)
+
+    def query(self, message):
+        return self.message(message) + '\n'
+
+    def close(self):
+        pass
+
+
+class simulated_resource_manager:
+    # Every open_resource() returns the same supply so its state survives reconnects
+
+    def __init__(self, supply=None):
+        self.supply = supply if supply is not None else simulated_power_supply()
+        self.connects = 0
+
+    def open_resource(self, visa_resource):
+        self.connects += 1
+        self.supply.clock.sleep(self.supply.latency)
+        return self.supply
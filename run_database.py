@@ -0,0 +1,206 @@
+# Import other libraries
+import json
+import os
+import sqlite3
+import time
+
+'''
+run database class
+Functionality:
+1) Keeps every calibration run in one indexed SQLite file: station, timestamps, setpoints,
+   per inverter readings (with spread and psu readback) and the fitted coefficients
+2) store_run() writes a whole run with bulk inserts in a single transaction, storing the same
+   run directory again replaces it, so re-archiving a run from main.py archive is safe
+3) inverter_history() and fleet_stats() answer drift questions across the archive from the small
+   indexed coefficients table, without scanning the readings
+'''
+
+schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    run_dir TEXT UNIQUE NOT NULL,
+    station TEXT,
+    started REAL,
+    saved REAL,
+    inverter_count INTEGER,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_saved ON runs (saved);
+CREATE INDEX IF NOT EXISTS runs_station ON runs (station, saved);
+
+CREATE TABLE IF NOT EXISTS inverters (
+    run_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    inverter_id TEXT,
+    PRIMARY KEY (run_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS inverters_id ON inverters (inverter_id, run_id);
+
+CREATE TABLE IF NOT EXISTS readings (
+    run_id INTEGER NOT NULL,
+    sweep TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    setpoint REAL NOT NULL,
+    value REAL,
+    spread REAL,
+    readback REAL,
+    timestamp REAL,
+    PRIMARY KEY (run_id, sweep, position, setpoint)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS coefficients (
+    run_id INTEGER NOT NULL,
+    sweep TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    inverter_id TEXT,
+    offset REAL,
+    gain REAL,
+    rms_error REAL,
+    max_error REAL,
+    points INTEGER,
+    terms TEXT,
+    PRIMARY KEY (run_id, sweep, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS coefficients_inverter ON coefficients (inverter_id, sweep, run_id);
+CREATE INDEX IF NOT EXISTS coefficients_sweep ON coefficients (sweep, run_id);
+'''
+
+
+def metadata_time(saved, default):
+    # metadata.json keeps the save time as "2024-01-01 12:00:00" local time
+    try:
+        return time.mktime(time.strptime(saved, "%Y-%m-%d %H:%M:%S"))
+    except (TypeError, ValueError):
+        return default
+
+
+class run_database:
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.row_factory = sqlite3.Row
+        # WAL lets the query tools read while a station writes
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        self.connection.close()
+
+    def reading_rows(self, run_id, sweep, store):
+        # One row per measured (setpoint, inverter), built column wise from the column_store arrays
+        rows = [row for row in range(store.size) if store.filled[row]]
+        setpoints = store.setpoints[rows].tolist()
+        readings = store.readings[rows].tolist()
+        spreads = store.spread[rows].tolist()
+        readbacks = store.readback[rows].tolist()
+        timestamps = store.timestamps[rows].tolist()
+        for i, setpoint in enumerate(setpoints):
+            for position in range(store.inverter_count):
+                yield (run_id, sweep, position, setpoint, readings[i][position], spreads[i][position],
+                       readbacks[i], timestamps[i])
+
+    def coefficient_rows(self, run_id, sweep, result, inverter_ids):
+        # Inverters without a fit have nan coefficients, nothing to store
+        for position in range(len(result.gain)):
+            if not result.fitted[position]:
+                continue
+            yield (run_id, sweep, position, inverter_ids[position] if position < len(inverter_ids) else None,
+                   float(result.offset[position]), float(result.gain[position]),
+                   float(result.rms_error[position]), float(result.max_error[position]),
+                   int(result.points[position]),
+                   json.dumps(dict(zip(result.term_names, result.coefficients[position].tolist()))))
+
+    def store_run(self, dm, saved, inverter_ids=None, voltage_fit=None, current_fit=None):
+        # Write (or replace) the run of a data_manager in one transaction, returns its run_id
+        # Coefficients are only replaced when fits are given, without inverter_ids the ids already
+        # stored for the run are kept
+        # One row per run however the directory was given, relative or absolute
+        run_dir = os.path.abspath(dm.get_run_dir())
+        # A run loaded from disk keeps the time it was saved, so backfilled runs sort where they belong
+        saved = metadata_time(dm.metadata.get('saved'), saved)
+        timestamps = [float(t) for store in (dm.vstore, dm.cstore)
+                      for t in store.timestamps[:store.size].tolist() if t == t]
+        started = min(timestamps) if timestamps else saved
+        metadata = json.dumps(dm.metadata, default=str)
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (run_dir, station, started, saved, inverter_count, metadata) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (run_dir) DO UPDATE SET station = excluded.station, started = excluded.started, '
+                'saved = excluded.saved, inverter_count = excluded.inverter_count, metadata = excluded.metadata',
+                (run_dir, dm.metadata.get('station'), started, saved, dm.inverter_count, metadata))
+            run_id = self.connection.execute('SELECT run_id FROM runs WHERE run_dir = ?', (run_dir,)).fetchone()[0]
+
+            if inverter_ids:
+                self.connection.execute('DELETE FROM inverters WHERE run_id = ?', (run_id,))
+                self.connection.executemany('INSERT INTO inverters VALUES (?, ?, ?)',
+                                            [(run_id, position, inverter_id)
+                                             for position, inverter_id in enumerate(inverter_ids)])
+            else:
+                inverter_ids = [row[0] for row in self.connection.execute(
+                    'SELECT inverter_id FROM inverters WHERE run_id = ? ORDER BY position', (run_id,))]
+            self.connection.execute('DELETE FROM readings WHERE run_id = ?', (run_id,))
+            self.connection.executemany('INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                        self.reading_rows(run_id, 'volts', dm.vstore))
+            self.connection.executemany('INSERT INTO readings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                        self.reading_rows(run_id, 'current', dm.cstore))
+            for sweep, result in (('volts', voltage_fit), ('current', current_fit)):
+                if result is not None:
+                    self.connection.execute('DELETE FROM coefficients WHERE run_id = ? AND sweep = ?', (run_id, sweep))
+                    self.connection.executemany('INSERT INTO coefficients VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                                self.coefficient_rows(run_id, sweep, result, inverter_ids))
+        print(f"Run stored in {self.db_file} (run {run_id})")
+        return run_id
+
+    def inverter_history(self, inverter_id, sweep='volts'):
+        # Every fit of one inverter, oldest first
+        rows = self.connection.execute(
+            'SELECT r.run_id, r.run_dir, r.station, r.saved, c.gain, c.offset, c.rms_error, c.max_error '
+            'FROM coefficients c JOIN runs r ON r.run_id = c.run_id '
+            'WHERE c.inverter_id = ? AND c.sweep = ? ORDER BY r.saved', (inverter_id, sweep)).fetchall()
+        return [dict(row) for row in rows]
+
+    def fleet_stats(self, sweep='volts', last_runs=None, station=None, since=None):
+        # Gain / offset statistics over the fitted inverters of the selected runs
+        # Only runs with a fit of the sweep count, verify only and single sweep runs have none
+        conditions = ['EXISTS (SELECT 1 FROM coefficients f WHERE f.sweep = ? AND f.run_id = runs.run_id)']
+        parameters = [sweep]
+        if station is not None:
+            conditions.append('station = ?')
+            parameters.append(station)
+        if since is not None:
+            conditions.append('saved >= ?')
+            parameters.append(since)
+        where = f"WHERE {' AND '.join(conditions)}"
+        limit = 'LIMIT ?' if last_runs is not None else ''
+        if last_runs is not None:
+            parameters.append(last_runs)
+        row = self.connection.execute(
+            'SELECT COUNT(*) AS inverters, COUNT(DISTINCT c.run_id) AS runs, '
+            'COUNT(DISTINCT c.inverter_id) AS units, MIN(r.saved) AS first_saved, MAX(r.saved) AS last_saved, '
+            'AVG(c.gain) AS gain_mean, MIN(c.gain) AS gain_min, MAX(c.gain) AS gain_max, '
+            'AVG(c.gain * c.gain) - AVG(c.gain) * AVG(c.gain) AS gain_variance, '
+            'AVG(c.offset) AS offset_mean, MIN(c.offset) AS offset_min, MAX(c.offset) AS offset_max, '
+            'AVG(c.offset * c.offset) - AVG(c.offset) * AVG(c.offset) AS offset_variance, '
+            'AVG(c.rms_error) AS rms_error_mean, MAX(c.max_error) AS max_error '
+            f'FROM (SELECT run_id, saved FROM runs {where} ORDER BY saved DESC {limit}) r '
+            'JOIN coefficients c ON c.run_id = r.run_id AND c.sweep = ?', parameters + [sweep]).fetchone()
+        stats = dict(row)
+        for name in ('gain', 'offset'):
+            variance = stats.pop(f'{name}_variance')
+            stats[f'{name}_std'] = max(variance, 0.0) ** 0.5 if variance is not None else None
+        return stats
+
+    def run_readings(self, run_id, sweep='volts'):
+        # (setpoint, position, value, spread) rows of one run, for re-fitting old runs
+        return [tuple(row) for row in self.connection.execute(
+            'SELECT setpoint, position, value, spread FROM readings WHERE run_id = ? AND sweep = ? '
+            'ORDER BY setpoint, position', (run_id, sweep))]
@@ -0,0 +1,33 @@
+#Import data library
+import warnings
+import numpy as np
+
+'''
+sample statistics
+Functionality:
+1) Combines N readings of one setpoint for every inverter channel at once (sample x inverter array)
+2) Rejects samples further than outlier_threshold scaled MADs from the channel median
+3) Returns the mean and standard deviation of the kept samples and how many were kept per channel
+'''
+
+# Scales the median absolute deviation to the standard deviation of normal noise
+mad_scale = 1.4826
+
+
+def robust_aggregate(samples, outlier_threshold=3.5):
+    # samples is (sample, inverter), nan readings are ignored
+    samples = np.asarray(samples, dtype=np.float64)
+    with warnings.catch_warnings():
+        # Channels without a single reading give all nan slice / degrees of freedom warnings
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(samples, axis=0)
+        deviation = np.abs(samples - median)
+        mad = mad_scale * np.nanmedian(deviation, axis=0)
+        # A mad of 0 (most samples identical) keeps only the samples equal to the median
+        with np.errstate(invalid='ignore'):
+            keep = deviation <= outlier_threshold * mad
+        kept = np.count_nonzero(keep, axis=0)
+        values = np.where(keep, samples, np.nan)
+        mean = np.nanmean(values, axis=0)
+        spread = np.where(kept > 1, np.nanstd(values, axis=0, ddof=1), np.nan)
+    return mean, spread, kept
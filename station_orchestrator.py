@@ -0,0 +1,137 @@
+# Import other libraries
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+
+import calibration_station as CS
+
+'''
+station orchestrator class
+Functionality:
+1) Reads a station config with one entry per rig (psu address, particle device, inverter count)
+2) Runs the calibration of every station at the same time, each in its own worker process
+3) Each station writes its own log and runs under save_directory/<station name>
+4) Prints an aggregate progress view of all stations while they run
+5) Stations are built by station_factory(config, station_dir), build_station by default, pass another
+   module level function (it is sent to the worker processes) to run against simulated hardware
+
+Example station config:
+{
+    "stations": [
+        {"name": "rig1", "ip_address": "10.10.223.99", "device_id": "<id>", "access_token": "<token>", "inverter_count": 3},
+        {"name": "rig2", "ip_address": "10.10.223.100", "device_id": "<id>", "access_token": "<token>", "inverter_count": 4}
+    ]
+}
+'''
+
+def load_station_config(config_file):
+    with open(config_file) as file:
+        config = json.load(file)
+    stations = config['stations']
+    names = [station['name'] for station in stations]
+    if len(set(names)) != len(names):
+        raise ValueError("Station names must be unique, they are used as output directories")
+    for station in stations:
+        for key in ('name', 'ip_address', 'device_id'):
+            if key not in station:
+                raise ValueError(f"Station config is missing '{key}': {station}")
+    return stations
+
+
+def build_station(config, station_dir):
+    # A calibration station on the rig of one station config entry
+    return CS.calibration_station(name=config['name'],
+                                  ip_address=config['ip_address'],
+                                  device_id=config['device_id'],
+                                  access_token=config.get('access_token'),
+                                  inverter_count=config.get('inverter_count', 3),
+                                  save_directory=station_dir)
+
+
+def run_station(config, save_directory, progress_queue, station_factory=build_station):
+    # Worker process entry point, everything the station prints goes to its own log
+    name = config['name']
+    station_dir = os.path.join(save_directory, name)
+    os.makedirs(station_dir, exist_ok=True)
+    log_file = os.path.join(station_dir, "station.log")
+
+    with open(log_file, mode='a', buffering=1) as log, redirect_stdout(log), redirect_stderr(log):
+        print(f"Starting station {name} at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        station = station_factory(config, station_dir)
+        station.progress = lambda station_name, sweep, done, total: progress_queue.put((station_name, sweep, done, total))
+        success = station.get_calibration(config.get('resume_run_dir'))
+    return {'name': name, 'success': success, 'run_dir': station.dm.run_dir, 'log_file': log_file}
+
+
+class station_orchestrator:
+    # Seconds between progress prints
+    progress_interval = 10.0
+
+    def __init__(self, stations, save_directory=None, max_workers=None, station_factory=build_station):
+        self.stations = stations
+        self.station_factory = station_factory
+        self.save_directory = save_directory if save_directory is not None else os.path.join(os.getcwd(), 'calibration_runs')
+        self.max_workers = max_workers if max_workers is not None else len(stations)
+        # name -> {sweep: (done, total)}
+        self.progress = {station['name']: {} for station in stations}
+        self.results = {}
+
+    def drain_progress(self, progress_queue):
+        while not progress_queue.empty():
+            name, sweep, done, total = progress_queue.get()
+            self.progress[name][sweep] = (done, total)
+
+    def print_progress(self):
+        all_done = 0
+        all_total = 0
+        for name, sweeps in self.progress.items():
+            if name in self.results:
+                state = "finished" if self.results[name]['success'] else "failed"
+            elif sweeps:
+                state = "running"
+            else:
+                state = "waiting"
+            parts = [f"{sweep} {done}/{total}" for sweep, (done, total) in sweeps.items()]
+            print(f"  {name}: {state} {' | '.join(parts)}")
+            all_done += sum(done for done, total in sweeps.values())
+            all_total += sum(total for done, total in sweeps.values())
+        if all_total:
+            print(f"Total: {all_done}/{all_total} steps ({100.0 * all_done / all_total:.1f}%), "
+                  f"{len(self.results)}/{len(self.stations)} stations done")
+
+    def run(self):
+        os.makedirs(self.save_directory, exist_ok=True)
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            progress_queue = manager.Queue()
+            futures = {pool.submit(run_station, station, self.save_directory, progress_queue,
+                                   self.station_factory): station['name']
+                       for station in self.stations}
+            last_print = time.monotonic()
+            while len(self.results) < len(futures):
+                time.sleep(0.5)
+                self.drain_progress(progress_queue)
+                for future, name in futures.items():
+                    if name in self.results or not future.done():
+                        continue
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        self.results[name] = {'name': name, 'success': False, 'error': str(e)}
+                    print(f"Station {name} {'finished' if self.results[name]['success'] else 'failed'}")
+                if time.monotonic() - last_print >= self.progress_interval:
+                    self.print_progress()
+                    last_print = time.monotonic()
+            self.drain_progress(progress_queue)
+        self.print_progress()
+        return self.results
+
+
+if __name__ == "__main__":
+    # python station_orchestrator.py stations.json [save directory]
+    stations = load_station_config(sys.argv[1])
+    orchestrator = station_orchestrator(stations, sys.argv[2] if len(sys.argv) > 2 else None)
+    orchestrator.run()
@@ -0,0 +1,102 @@
+# Import other libraries
+import csv
+import json
+import threading
+from contextlib import contextmanager
+
+import sweep_clock as SC
+
+'''
+step profiler class
+Functionality:
+1) Records spans (sweep step, phase, start, duration, retries) around the hot path of a sweep:
+   VISA connect, every SCPI write/query, settle wait, cooldown, particle HTTP call, parsing,
+   data append and run save
+2) Aggregates the spans into count / total / p50 / p95 / max per phase
+3) Exports the raw spans as JSON or CSV
+'''
+
+def percentile(values, fraction):
+    # Nearest rank percentile, fraction between 0 and 1
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class step_profiler:
+
+    def __init__(self, clock=None, enabled=True):
+        self.clock = clock if clock is not None else SC.system_clock()
+        self.enabled = enabled
+        self.spans = []
+        self.lock = threading.Lock()
+        # Step label per thread, fetches for a step can run on another thread
+        self.local = threading.local()
+
+    def set_step(self, step):
+        self.local.step = step
+
+    def current_step(self):
+        return getattr(self.local, 'step', None)
+
+    def record(self, phase, start, duration, retries=0, detail=None):
+        if not self.enabled:
+            return
+        span = {'step': self.current_step(), 'phase': phase, 'start': start,
+                'duration': duration, 'retries': retries, 'detail': detail}
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, phase, detail=None):
+        # with profiler.span('scpi_query', command): ...
+        if not self.enabled:
+            yield
+            return
+        start = self.clock.now()
+        try:
+            yield
+        finally:
+            self.record(phase, start, self.clock.now() - start, detail=detail)
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+    def summary(self):
+        # phase -> count, total, p50, p95, max seconds and retries
+        durations = {}
+        retries = {}
+        with self.lock:
+            for span in self.spans:
+                durations.setdefault(span['phase'], []).append(span['duration'])
+                retries[span['phase']] = retries.get(span['phase'], 0) + span['retries']
+        return {phase: {'count': len(values), 'total': sum(values), 'p50': percentile(values, 0.5),
+                        'p95': percentile(values, 0.95), 'max': max(values), 'retries': retries[phase]}
+                for phase, values in durations.items()}
+
+    def report(self):
+        summary = self.summary()
+        print(f"{'Phase':<20}{'Count':>8}{'Total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'Max ms':>10}{'Retries':>9}")
+        for phase, stats in sorted(summary.items(), key=lambda item: -item[1]['total']):
+            print(f"{phase:<20}{stats['count']:>8}{stats['total']:>10.2f}{stats['p50'] * 1000:>10.1f}"
+                  f"{stats['p95'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}{stats['retries']:>9}")
+        return summary
+
+    def to_json(self, json_file):
+        with self.lock:
+            spans = list(self.spans)
+        with open(json_file, mode='w') as file:
+            json.dump({'summary': self.summary(), 'spans': spans}, file, indent=2, default=str)
+        print(f"Profile written to {json_file}")
+
+    def to_csv(self, csv_file):
+        header = ['step', 'phase', 'start', 'duration', 'retries', 'detail']
+        with self.lock:
+            spans = list(self.spans)
+        with open(csv_file, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=header)
+            writer.writeheader()
+            writer.writerows(spans)
+        print(f"Profile written to {csv_file}")
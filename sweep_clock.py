@@ -0,0 +1,46 @@
+# Import other libraries
+import threading
+import time
+
+'''
+sweep clock classes
+Functionality:
+1) system_clock wraps time.monotonic / time.sleep, the default for every controller and sweep
+2) virtual_clock advances instantly on sleep() so a complete calibration plan can be dry run in
+   seconds to estimate its duration and check the sequencing
+3) Pass the same clock to the station, psu controller, particle manager and simulators
+'''
+
+class system_clock:
+
+    def now(self):
+        # Seconds, only differences are meaningful
+        return time.monotonic()
+
+    def wall_time(self):
+        # Unix time used for reading timestamps
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class virtual_clock:
+
+    def __init__(self, start=0.0):
+        self.lock = threading.Lock()
+        self.start_wall_time = time.time()
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def wall_time(self):
+        return self.start_wall_time + self.current
+
+    def sleep(self, seconds):
+        # Time only moves when something waits, nothing actually blocks
+        if seconds > 0:
+            with self.lock:
+                self.current += seconds
@@ -0,0 +1,55 @@
+# Import other libraries
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import sweep_clock as SC
+import step_profiler as SP
+
+'''
+sweep engine class
+Functionality:
+1) Runs a sweep as a pipeline instead of set psu -> sleep -> fetch -> append one at a time
+2) The data append / csv write of the previous step always runs on its own thread while the psu
+   programs and settles the next step
+3) The particle fetch of a step always finishes before the next setpoint is programmed, a cloud call
+   does not say when the inverters sampled, so a fetch overlapping the next step could be recorded
+   under the wrong setpoint
+4) At most max_in_flight records are pending, results are recorded in setpoint order
+'''
+
+class sweep_engine:
+    # config values
+    max_in_flight = 2
+
+    def __init__(self, set_point, fetch, record, clock=None, profiler=None, name=''):
+        # set_point(setpoint) programs and settles the psu
+        # fetch() returns the inverter readings for the current psu output
+        # record(setpoint, readings) stores a result, always called in sweep order from one thread
+        self.set_point = set_point
+        self.fetch = fetch
+        self.record = record
+        self.clock = clock if clock is not None else SC.system_clock()
+        # Spans are labelled '<name> <setpoint>' on whichever thread handles the step
+        self.profiler = profiler if profiler is not None else SP.step_profiler(self.clock, enabled=False)
+        self.name = name
+
+    def step_label(self, setpoint):
+        return f"{self.name} {setpoint}".strip()
+
+    def record_step(self, setpoint, readings):
+        self.profiler.set_step(self.step_label(setpoint))
+        self.record(setpoint, readings)
+
+    def run(self, setpoints):
+        records = deque()
+        with ThreadPoolExecutor(max_workers=1) as record_pool:
+            for setpoint in setpoints:
+                self.profiler.set_step(self.step_label(setpoint))
+                self.set_point(setpoint)
+                # The reading has to finish before the psu can change
+                readings = self.fetch()
+                records.append(record_pool.submit(self.record_step, setpoint, readings))
+                # Surface record errors early and keep the record queue bounded
+                while records and (records[0].done() or len(records) > self.max_in_flight):
+                    records.popleft().result()
+            while records:
+                records.popleft().result()
@@ -0,0 +1,70 @@
+'''
+sweep planner class
+Functionality:
+1) Builds the voltage and current sweeps into one schedule of ('volts' | 'current', setpoint, cooldown) steps
+2) Runs the hottest current step the resistor can take right now, when no current step is safe it
+   runs low dissipation voltage steps instead of sitting at 0 V waiting for the resistor to cool
+3) Only falls back to a real cooldown when the voltage steps are used up
+4) Estimates the total runtime before the run starts, and the runtime of the old back to back sweeps
+'''
+
+class sweep_planner:
+
+    def __init__(self, thermal, v_duration, c_duration, v_current_limit, c_heat_duration=None):
+        # thermal is the station thermal_model
+        # v_duration / c_duration are the expected seconds per voltage / current step
+        # v_current_limit is the psu current limit of the voltage sweep, kpsu.stable_curr
+        # c_heat_duration is the longest a current step stays powered, used for the temperature limit
+        self.thermal = thermal
+        self.v_duration = v_duration
+        self.c_duration = c_duration
+        self.v_current_limit = v_current_limit
+        self.c_heat_duration = c_duration if c_heat_duration is None else c_heat_duration
+        self.total_dwell = 0.0
+        self.peak_temp = thermal.temperature
+        self.estimate = 0.0
+
+    def plan(self, v_setpoints, c_setpoints, start_temp=None):
+        thermal = self.thermal
+        temperature = thermal.temperature if start_temp is None else start_temp
+        voltages = sorted(v_setpoints)
+        currents = sorted(c_setpoints)
+        steps = []
+        self.total_dwell = 0.0
+        self.peak_temp = temperature
+
+        while currents:
+            ready = [s for s in currents if thermal.required_dwell(s, self.c_heat_duration, temperature) == 0.0]
+            if not ready and voltages:
+                # The resistor cools during a voltage step, it only carries the small stable_curr load
+                setpoint = voltages.pop(0)
+                power = thermal.voltage_step_power(setpoint, self.v_current_limit)
+                temperature = thermal.temperature_after(temperature, power, self.v_duration)
+                steps.append(('volts', setpoint, 0.0))
+                continue
+            setpoint = ready[-1] if ready else currents[0]
+            dwell = thermal.required_dwell(setpoint, self.c_heat_duration, temperature)
+            temperature = thermal.temperature_after(temperature, 0.0, dwell)
+            temperature = thermal.temperature_after(temperature, thermal.step_power(setpoint), self.c_heat_duration)
+            self.peak_temp = max(self.peak_temp, temperature)
+            self.total_dwell += dwell
+            currents.remove(setpoint)
+            steps.append(('current', setpoint, dwell))
+        steps.extend(('volts', setpoint, 0.0) for setpoint in voltages)
+
+        self.estimate = (len(v_setpoints) * self.v_duration + len(c_setpoints) * self.c_duration
+                         + self.total_dwell)
+        interleaved = sum(1 for i, step in enumerate(steps[:-1]) if step[0] == 'volts' and steps[i + 1][0] == 'current')
+        print(f"Combined sweep plan: {len(v_setpoints)} voltage and {len(c_setpoints)} current steps, "
+              f"{interleaved} voltage runs used as cooldown, total cooldown {self.total_dwell:.1f} s, "
+              f"peak {self.peak_temp:.1f} C")
+        return steps
+
+    def sequential_estimate(self, v_setpoints, c_setpoints, finish_delay):
+        # Runtime of full_voltage_sweep then full_current_sweep with the psu off in between
+        thermal = self.thermal
+        orders = [sorted(c_setpoints), thermal.interleaved_order(c_setpoints),
+                  thermal.greedy_order(c_setpoints, self.c_heat_duration)]
+        total_dwell = min(thermal.schedule(order, self.c_heat_duration)[1] for order in orders)
+        return (len(v_setpoints) * self.v_duration + finish_delay
+                + len(c_setpoints) * self.c_duration + total_dwell)
@@ -0,0 +1,50 @@
+# Import other libraries
+import os
+import sys
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sweep_clock as SC
+import calibration_station as CS
+import psu_simulator as PS
+import particle_simulator as PSIM
+
+'''
+test fixtures
+Functionality:
+1) make_station() builds a calibration_station wired to the simulated power supply and the in
+   process particle simulator on a virtual clock, a full calibration runs in a few seconds
+2) Every station counts its cloud calls by function name in station.calls and gets its own run directory
+'''
+
+@pytest.fixture
+def make_station(tmp_path):
+    stations = []
+
+    def build(inverter_count=3, seed=0):
+        clock = SC.virtual_clock()
+        supply = PS.simulated_power_supply(clock)
+        cloud = PSIM.particle_simulator(supply, inverter_count, seed)
+        station = CS.calibration_station(name="test", device_id="test", inverter_count=inverter_count,
+                                         save_directory=str(tmp_path), clock=clock)
+        station.kpsu.rm = PS.simulated_resource_manager(supply)
+        station.kpsu.load_switch = supply.connect_load
+        station.finish_delay = 0
+        # Run directories are named by the second, stations built in the same second would share one
+        stations.append(station)
+        station.dm.run_dir = str(tmp_path / f"run_{len(stations)}")
+        station.calls = {}
+
+        def call_function(function_name):
+            station.calls[function_name] = station.calls.get(function_name, 0) + 1
+            return cloud.local_call(function_name)
+
+        station.pm.call_function = call_function
+        station.supply = supply
+        station.cloud = cloud
+        return station
+
+    return build
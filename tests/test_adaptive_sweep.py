@@ -0,0 +1,31 @@
+import numpy as np
+
+import adaptive_sweep as AS
+
+
+def measure(points, response):
+    points = np.array(points, dtype=np.float64)
+    return points, np.column_stack([response(points), response(points) * 1.01])
+
+
+def test_linear_response_stops_after_coarse_grid():
+    grid = [round(i * 0.1, 3) for i in range(201)]
+    refiner = AS.adaptive_refiner(grid, 0.01, 0.02)
+    assert refiner.refine(*measure(refiner.initial_points(), lambda x: x)) == []
+
+
+def test_refines_only_around_a_knee():
+    grid = [round(i * 0.1, 3) for i in range(201)]
+    refiner = AS.adaptive_refiner(grid, 0.01, 0.02)
+
+    def response(x):
+        return np.minimum(x, 12.3)
+
+    points = refiner.initial_points()
+    new_points = refiner.refine(*measure(points, response))
+    assert new_points
+    assert all(10.0 <= point <= 14.0 for point in new_points)
+    while new_points:
+        points = sorted(points + new_points)
+        new_points = refiner.refine(*measure(points, response))
+    assert len(points) < len(grid)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import calibration_fit as CF
+import calibration_cache as CC
+
+
+def test_fit_recovers_gain_and_offset_per_inverter():
+    setpoints = np.linspace(0.0, 20.0, 41)
+    measured = np.column_stack([setpoints * 1.02 - 0.03, setpoints * 0.97 + 0.01])
+    result = CF.calibration_fit().fit(setpoints, measured)
+    assert result.gain == pytest.approx([1 / 1.02, 1 / 0.97])
+    assert result.offset == pytest.approx([0.03 / 1.02, -0.01 / 0.97])
+    assert result.max_error.max() < 1e-9
+
+
+def test_nan_readings_are_skipped():
+    setpoints = np.array([0.0, 1.0, 2.0, 3.0, np.nan])
+    measured = np.array([[0.0, 0.0], [2.0, np.nan], [4.0, 2.0], [6.0, 3.0], [np.nan, np.nan]])
+    result = CF.calibration_fit().fit(setpoints, measured)
+    assert result.points.tolist() == [4, 3]
+    assert result.gain == pytest.approx([0.5, 1.0])
+
+
+def test_breakpoint_fits_piecewise_response():
+    setpoints = np.linspace(0.0, 10.0, 21)
+    measured = np.where(setpoints < 5.0, setpoints, 5.0 + 2.0 * (setpoints - 5.0))[:, np.newaxis]
+    fit = CF.calibration_fit(breakpoints=[5.0])
+    result = fit.fit(setpoints, measured)
+    assert result.max_error[0] < 1e-9
+    assert fit.apply(result.coefficients, measured)[:, 0] == pytest.approx(setpoints)
+
+
+def test_dead_channel_is_flagged_not_fitted(tmp_path, recwarn):
+    setpoints = np.linspace(0.0, 10.0, 11)
+    measured = np.column_stack([setpoints * 2.0, np.full_like(setpoints, np.nan)])
+    # One reading is not enough to solve gain and offset either
+    measured[3, 1] = 6.0
+    result = CF.calibration_fit().fit(setpoints, measured)
+    assert result.fitted.tolist() == [True, False]
+    assert result.unfitted() == [1]
+    assert np.isnan(result.coefficients[1]).all()
+    assert result.gain[0] == pytest.approx(0.5)
+    assert not [warning for warning in recwarn if issubclass(warning.category, RuntimeWarning)]
+
+    csv_file = tmp_path / "coefficients.csv"
+    result.to_csv(csv_file)
+    rows = csv_file.read_text().splitlines()
+    assert len(rows) == 2 and rows[1].startswith('1,')
+
+
+def test_dead_channel_is_not_cached(tmp_path):
+    setpoints = np.linspace(0.0, 10.0, 11)
+    measured = np.column_stack([setpoints * 2.0, np.full_like(setpoints, np.nan)])
+    fit = CF.calibration_fit()
+    result = fit.fit(setpoints, measured)
+    cache = CC.calibration_cache(str(tmp_path / "cache.json"))
+    assert cache.put("good", fit, result, result, 0, 0.0)
+    assert not cache.put("dead", fit, result, result, 1, 0.0)
+    assert list(cache.entries) == ["good"]
@@ -0,0 +1,117 @@
+import main
+import calibration_station as CS
+
+
+def test_current_heat_duration_covers_every_sample(make_station):
+    station = make_station()
+    timeout = station.pm.timeout[1]
+    assert station.current_heat_duration() == station.kpsu.c_settle_delay + timeout
+    station.samples_per_setpoint = 5
+    station.concurrent_samples = False
+    assert station.current_heat_duration() == station.kpsu.c_settle_delay + 5 * timeout
+    station.ingest_mode = 'stream'
+    station.concurrent_samples = True
+    assert station.current_heat_duration() == station.kpsu.c_settle_delay + 5 * timeout
+
+
+def test_multi_sample_current_plan_stays_under_temp_limit(make_station):
+    station = make_station()
+    station.samples_per_setpoint = 3
+    station.concurrent_samples = False
+    duration = station.current_heat_duration()
+    thermal = station.thermal
+    plan = thermal.plan_current_sweep(station.kpsu.current_setpoints(), duration)
+    plan, total_dwell, peak_temp = thermal.schedule([setpoint for setpoint, dwell in plan], duration)
+    assert peak_temp <= thermal.temp_limit + 1e-9
+
+
+def test_current_sweep_refuses_samples_the_resistor_cannot_take(make_station):
+    station = make_station()
+    station.samples_per_setpoint = 10
+    station.concurrent_samples = False
+    assert not station.get_calibration()
+    assert station.dm.cstore.measured_count() == 0
+
+
+def test_settle_probe_follows_the_sweep(make_station):
+    station = make_station()
+    station.settle_on_inverters = True
+    station.kpsu.settle_mode = 'adaptive'
+    station.full_current_sweep()
+    # The current steps wait for stable inverter currents, not voltages
+    assert station.pm.volt_call not in station.calls
+    assert station.calls[station.pm.curr_call] > len(station.kpsu.current_setpoints())
+    station.set_sweep('volts')
+    assert station.kpsu.settle_probe == station.pm.get_measured_voltages
+
+
+def track_peak(thermal):
+    # Highest modeled resistor temperature at the end of any powered step
+    peak = [thermal.temperature]
+    heat = thermal.heat
+
+    def tracked_heat(current_setpoint, duration):
+        heat(current_setpoint, duration)
+        peak[0] = max(peak[0], thermal.temperature)
+
+    thermal.heat = tracked_heat
+    return peak
+
+
+def test_current_sweep_waits_on_the_thermal_model_not_a_fixed_delay(make_station):
+    station = make_station()
+    thermal = station.thermal
+    # Constants where the cooldown binds
+    thermal.thermal_resistance = 0.6
+    thermal.time_constant = 300.0
+    thermal.temp_limit = 45.0
+    peak = track_peak(thermal)
+    start = station.clock.now()
+    station.full_current_sweep()
+    elapsed = station.clock.now() - start
+    setpoints = station.kpsu.current_setpoints()
+    assert station.dm.cstore.measured_count() == len(setpoints)
+    assert peak[0] <= thermal.temp_limit + 1e-9
+    assert station.profiler.summary()['cooldown']['count'] > 0
+    # Far from the old fixed wait of c_delay powered seconds per step
+    assert elapsed < len(setpoints) * station.kpsu.c_delay
+
+
+def test_combined_sweep_cools_down_with_voltage_steps(make_station):
+    station = make_station()
+    thermal = station.thermal
+    thermal.thermal_resistance = 0.6
+    thermal.time_constant = 300.0
+    thermal.temp_limit = 45.0
+    peak = track_peak(thermal)
+    # Sweep of every group in run order
+    groups = []
+    set_sweep = station.set_sweep
+
+    def logged_set_sweep(sweep):
+        groups.append(sweep)
+        set_sweep(sweep)
+
+    station.set_sweep = logged_set_sweep
+    station.combined_sweep()
+    assert station.dm.vstore.measured_count() == len(station.kpsu.voltage_setpoints())
+    assert station.dm.cstore.measured_count() == len(station.kpsu.current_setpoints())
+    assert peak[0] <= thermal.temp_limit + 1e-9
+    # Voltage groups run between current steps, while the resistor cools
+    gaps = [i for i in range(1, len(groups) - 1)
+            if groups[i] == 'volts' and groups[i - 1] == 'current' and groups[i + 1] == 'current']
+    assert gaps
+    # Enough voltage steps to cover every cooldown, the psu never sat idle
+    assert 'cooldown' not in station.profiler.summary()
+
+
+def test_plan_uses_the_station_heat_duration(capsys):
+    station = CS.calibration_station()
+    station.samples_per_setpoint = 3
+    plan = station.thermal.plan_current_sweep(station.kpsu.current_setpoints(), station.current_heat_duration())
+    assert main.main(['plan', '--samples', '3']) == 0
+    order = "Order: " + ", ".join(f"{setpoint} A" + (f" (+{dwell:.0f} s)" if dwell else "") for setpoint, dwell in plan)
+    assert order in capsys.readouterr().out
+    # Ten streamed samples keep a step powered too long, the station refuses and so does the plan
+    assert main.main(['plan', '--samples', '10', '--ingest', 'stream']) == 1
+    assert "No safe current plan" in capsys.readouterr().out
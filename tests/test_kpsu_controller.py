@@ -0,0 +1,68 @@
+import pytest
+
+import sweep_clock as SC
+import kpsu_controller as KPSU
+import psu_simulator as PS
+
+
+def simulated_psu():
+    clock = SC.virtual_clock()
+    supply = PS.simulated_power_supply(clock)
+    kpsu = KPSU.kn57psu_controller(clock)
+    kpsu.rm = PS.simulated_resource_manager(supply)
+    kpsu.load_switch = supply.connect_load
+    kpsu.v_delay = 1
+    return kpsu, supply
+
+
+@pytest.mark.parametrize('batch_scpi', [True, False])
+def test_readback_is_taken_after_settling(batch_scpi):
+    kpsu, supply = simulated_psu()
+    kpsu.set_vc_flag('volts')
+    kpsu.batch_scpi = batch_scpi
+    with kpsu:
+        for setpoint in (0.1, 0.2, 0.3):
+            readback = float(kpsu.control_power_supply(setpoint, kpsu.stable_curr))
+            assert readback == pytest.approx(setpoint, abs=0.005)
+
+
+def test_adaptive_settle_stops_once_readings_are_stable():
+    kpsu, supply = simulated_psu()
+    kpsu.v_delay = 10
+    kpsu.settle_mode = 'adaptive'
+    kpsu.set_vc_flag('volts')
+    with kpsu:
+        kpsu.control_power_supply(5.0, kpsu.stable_curr)
+    max_delay, settle_time = kpsu.settle_times[-1]
+    assert max_delay == 10
+    # settle_samples readings within tolerance take at least settle_samples - 1 poll intervals
+    assert (kpsu.settle_samples - 1) * kpsu.settle_poll_interval <= settle_time < 2.0
+
+
+def test_unstable_settle_probe_waits_the_full_delay():
+    kpsu, supply = simulated_psu()
+    kpsu.v_delay = 5
+    kpsu.settle_mode = 'adaptive'
+    readings = iter(range(1000))
+    # An inverter reading that keeps drifting by more than settle_probe_tolerance
+    kpsu.settle_probe = lambda: [next(readings) * 0.1]
+    kpsu.set_vc_flag('volts')
+    with kpsu:
+        kpsu.control_power_supply(5.0, kpsu.stable_curr)
+    assert kpsu.settle_times[-1][1] == pytest.approx(5.0, abs=0.05)
+
+
+def test_is_settled_checks_every_channel_against_its_tolerance():
+    kpsu = KPSU.kn57psu_controller(SC.virtual_clock())
+    stable = [(1.000, 0.005), (2.0, 0.01)]
+    assert not kpsu.is_settled([stable, stable])
+    assert kpsu.is_settled([stable, [(1.004, 0.005), (2.009, 0.01)], stable])
+    assert not kpsu.is_settled([stable, [(1.004, 0.005), (2.02, 0.01)], stable])
+
+
+def test_fixed_settle_sleeps_the_full_delay():
+    kpsu, supply = simulated_psu()
+    kpsu.set_vc_flag('volts')
+    with kpsu:
+        kpsu.control_power_supply(5.0, kpsu.stable_curr)
+    assert kpsu.settle_times[-1] == (1, 1)
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+import sweep_clock as SC
+import psu_simulator as PS
+import particle_simulator as PSIM
+import particle_manager as PM
+import particle_events as PE
+
+
+@pytest.fixture
+def event_stream():
+    streams = []
+
+    def build(cloud_clock=None):
+        # The simulator stamps published_at with its supply clock, the stream compares with the host clock
+        supply = PS.simulated_power_supply(cloud_clock if cloud_clock is not None else SC.system_clock())
+        cloud = PSIM.particle_simulator(supply)
+        cloud.publish_interval = 0.02
+        cloud.start()
+        pm = PM.particle_manager()
+        pm.url = cloud.url
+        pm.device_id = "test"
+        events = PE.particle_event_stream(pm)
+        streams.append((events, cloud))
+        return events
+
+    yield build
+    for events, cloud in streams:
+        events.stop()
+        cloud.stop()
+
+
+def test_readings_after_only_returns_later_events(event_stream):
+    events = event_stream()
+    events.start()
+    # Let some events arrive that are older than the settle time
+    deadline = time.time() + 5
+    while len(events.buffers.get(events.volt_event, ())) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    after = time.time()
+    readings = events.readings_after(events.volt_event, after, count=2, timeout=5)
+    with events.condition:
+        buffered = list(events.buffers[events.volt_event])
+    assert any(timestamp <= after for timestamp, values in buffered)
+    later = [values for timestamp, values in buffered if timestamp > after]
+    assert readings == later[:2]
+    assert len(readings[0]) == 3
+
+
+def test_readings_after_times_out(event_stream):
+    events = event_stream()
+    with pytest.raises(PM.particle_error, match="0 of 1"):
+        events.readings_after("noSuchEvent", time.time(), timeout=0.2)
+
+
+def test_host_clock_behind_the_cloud_is_reported(event_stream, capsys):
+    # The cloud clock runs 5 s ahead of the host
+    cloud_clock = SC.virtual_clock()
+    cloud_clock.start_wall_time = time.time() + 5.0
+    events = event_stream(cloud_clock)
+    events.reading_after(events.volt_event, 0.0, timeout=5)
+    assert events.clock_offset < -4.0
+    assert "host clock is" in capsys.readouterr().out
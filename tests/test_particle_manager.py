@@ -0,0 +1,69 @@
+import random
+import socket
+
+import pytest
+
+import sweep_clock as SC
+import psu_simulator as PS
+import particle_simulator as PSIM
+import particle_manager as PM
+
+
+@pytest.fixture
+def cloud():
+    clock = SC.virtual_clock()
+    simulator = PSIM.particle_simulator(PS.simulated_power_supply(clock))
+    simulator.latency = 0
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+def particle(url):
+    pm = PM.particle_manager(SC.virtual_clock())
+    pm.url = url
+    pm.device_id = "test"
+    pm.timeout = (1, 1)
+    return pm
+
+
+def closed_port_url():
+    # A port nothing listens on, every connection is refused
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1/devices"
+
+
+def test_successful_call_records_latency(cloud):
+    pm = particle(cloud.url)
+    assert pm.get_inverter_num() == cloud.inverter_count
+    assert len(pm.latencies[pm.inverter_num_call]) == 1
+    assert pm.retry_counts[pm.inverter_num_call] == 0
+
+
+def test_client_error_is_not_retried(cloud):
+    pm = particle(cloud.url)
+    with pytest.raises(PM.particle_error, match="404"):
+        pm.call_function("notAFunction")
+    assert cloud.requests == 1
+    # No backoff wait before giving up
+    assert pm.clock.now() == 0
+
+
+def test_connection_errors_retry_with_backoff(monkeypatch):
+    # Largest jitter so the waits are the backoff caps
+    monkeypatch.setattr(random, 'uniform', lambda low, high: high)
+    pm = particle(closed_port_url())
+    with pytest.raises(PM.particle_error, match=pm.volt_call):
+        pm.call_function(pm.volt_call)
+    # One wait between each of the attempts, doubling from backoff_base
+    waits = [pm.backoff_base * 2 ** attempt for attempt in range(pm.max_retry_attempts - 1)]
+    assert pm.clock.now() == pytest.approx(sum(waits))
+    assert pm.volt_call not in pm.latencies
+
+
+def test_backoff_is_capped():
+    pm = particle("http://unused")
+    for attempt in range(1, 12):
+        assert 0 <= pm.backoff_delay(attempt) <= pm.backoff_max
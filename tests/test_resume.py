@@ -0,0 +1,120 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+import adaptive_sweep as AS
+import data_manager as DM
+import particle_manager as PM
+
+
+def crash_after(station, function_name, calls):
+    # The cloud stops answering after calls requests of function_name, like a bench losing power
+    call_function = station.pm.call_function
+
+    def crashing_call(name):
+        if name == function_name and station.calls.get(name, 0) >= calls:
+            raise PM.particle_error("bench lost power")
+        return call_function(name)
+
+    station.pm.call_function = crashing_call
+
+
+def test_resume_after_crash_in_current_sweep(make_station):
+    station = make_station()
+    crash_after(station, station.pm.curr_call, 5)
+    assert not station.get_calibration()
+    run_dir = station.dm.get_run_dir()
+    # The finished voltage sweep must still be resumable
+    assert os.path.exists(os.path.join(run_dir, "calibration_voltages_stream.csv"))
+
+    resumed = make_station()
+    assert resumed.get_calibration(resume_run_dir=run_dir)
+    assert resumed.calls.get(resumed.pm.volt_call, 0) == 0
+    assert resumed.calls[resumed.pm.curr_call] == len(resumed.kpsu.current_setpoints()) - 5
+    assert resumed.dm.vstore.measured_count() == len(resumed.kpsu.voltage_setpoints())
+    assert resumed.dm.cstore.measured_count() == len(resumed.kpsu.current_setpoints())
+    # Streams are only removed once the calibration is complete
+    assert not os.path.exists(os.path.join(run_dir, "calibration_voltages_stream.csv"))
+    assert not os.path.exists(os.path.join(run_dir, "calibration_currents_stream.csv"))
+
+
+def test_resume_restores_readback_and_timestamps(make_station):
+    station = make_station()
+    crash_after(station, station.pm.curr_call, 5)
+    assert not station.get_calibration()
+    run_dir = station.dm.get_run_dir()
+
+    resumed = make_station()
+    resumed.clock.sleep(3600)
+    assert resumed.get_calibration(resume_run_dir=run_dir)
+    for before, after in ((station.dm.vstore, resumed.dm.vstore), (station.dm.cstore, resumed.dm.cstore)):
+        rows = np.flatnonzero(before.filled[:before.size])
+        assert len(rows) > 0
+        for row in rows.tolist():
+            resumed_row = after.index[after.key(before.setpoints[row])]
+            # Resumed rows keep the time they were measured, not the time of the resume
+            assert after.timestamps[resumed_row] == before.timestamps[row]
+            assert after.readback[resumed_row] == before.readback[row]
+    metadata = json.loads(open(os.path.join(run_dir, "metadata.json")).read())
+    # Saved on the station clock, an hour ahead of the host
+    saved = time.mktime(time.strptime(metadata['saved'], "%Y-%m-%d %H:%M:%S"))
+    assert abs(saved - resumed.clock.wall_time()) < 2.0
+    assert saved > time.time() + 3000
+
+
+def write_stream(tmp_path, text, offset=None):
+    csv_file = tmp_path / "calibration_voltages_stream.csv"
+    csv_file.write_bytes(text.encode())
+    if offset is not None:
+        journal = {'last_setpoint': 0.0, 'rows': 0, 'offset': offset}
+        (tmp_path / "calibration_voltages_stream.journal").write_text(json.dumps(journal))
+    return str(csv_file)
+
+
+def test_recover_drops_partial_last_row(tmp_path):
+    # Journal written after the last row, but the csv lost the end of it in a power loss
+    text = "Ref,Inv 1,Inv 2\r\n0.1,0.1012,0.0991\r\n0.2,0.4"
+    csv_file = write_stream(tmp_path, text, offset=len(text) + 10)
+    stream = DM.csv_stream(csv_file, ['Ref', 'Inv 1', 'Inv 2'], resume=True)
+    stream.write_row([0.2, 0.2011, 0.1987])
+    stream.close()
+    assert stream.rows == [[0.1, 0.1012, 0.0991], [0.2, 0.2011, 0.1987]]
+    with open(csv_file, newline='') as file:
+        assert list(csv.reader(file))[1:] == [['0.1', '0.1012', '0.0991'], ['0.2', '0.2011', '0.1987']]
+
+
+def test_recover_drops_rows_with_missing_columns(tmp_path):
+    csv_file = write_stream(tmp_path, "Ref,Inv 1,Inv 2\r\n0.1,0.1012\r\n0.2,0.2011,0.1987\r\n")
+    stream = DM.csv_stream(csv_file, ['Ref', 'Inv 1', 'Inv 2'], resume=True)
+    stream.close()
+    assert stream.completed_setpoints() == {0.2}
+
+
+def test_adaptive_resume_keeps_refining(make_station):
+    station = make_station()
+    # Tight enough that the measurement noise asks for refinement after the coarse round
+    station.adaptive_v_tolerance = 1e-5
+    coarse = len(AS.adaptive_refiner(station.kpsu.voltage_setpoints(), 0, 0).initial_points())
+    crash_after(station, station.pm.volt_call, coarse)
+    assert not station.get_calibration(adaptive=True)
+    run_dir = station.dm.get_run_dir()
+
+    resumed = make_station()
+    resumed.adaptive_v_tolerance = 1e-5
+    assert resumed.get_calibration(resume_run_dir=run_dir, adaptive=True)
+    assert resumed.calls[resumed.pm.volt_call] > 0
+    assert resumed.dm.vstore.measured_count() > coarse
+
+
+def test_stream_with_another_header_is_not_resumed(tmp_path):
+    # Written without the std columns, resumed as a multi sample sweep
+    csv_file = write_stream(tmp_path, "Ref,Inv 1,Inv 2\r\n0.1,0.1012,0.0991\r\n")
+    header = ['Ref', 'Inv 1', 'Inv 2', 'Std 1', 'Std 2']
+    stream = DM.csv_stream(csv_file, header, resume=True)
+    stream.close()
+    assert stream.rows == []
+    with open(csv_file, newline='') as file:
+        assert list(csv.reader(file)) == [header]
@@ -0,0 +1,108 @@
+import json
+import time
+
+import main
+import particle_manager as PM
+import run_database as RD
+
+
+def test_archive_again_without_ids_keeps_history(make_station, tmp_path):
+    database_file = str(tmp_path / "runs.db")
+    station = make_station()
+    station.dm.database_file = database_file
+    assert station.get_calibration()
+    inverter_id = station.cloud.inverter_ids[0]
+    with RD.run_database(database_file) as database:
+        assert len(database.inverter_history(inverter_id)) == 1
+
+    main.main(['archive', database_file, station.dm.get_run_dir()])
+    with RD.run_database(database_file) as database:
+        history = database.inverter_history(inverter_id)
+    assert len(history) == 1
+
+
+def test_backfilled_run_keeps_its_save_time_and_path(make_station, tmp_path, monkeypatch):
+    database_file = str(tmp_path / "runs.db")
+    station = make_station()
+    station.dm.run_dir = str(tmp_path / "run_old")
+    assert station.get_calibration()
+    metadata_file = tmp_path / "run_old" / "metadata.json"
+    metadata = json.loads(metadata_file.read_text())
+    metadata['saved'] = "2020-01-02 03:04:05"
+    metadata_file.write_text(json.dumps(metadata))
+
+    monkeypatch.chdir(tmp_path)
+    main.main(['archive', database_file, "run_old"])
+    main.main(['archive', database_file, str(tmp_path / "run_old")])
+    with RD.run_database(database_file) as database:
+        runs = database.connection.execute('SELECT run_dir, saved FROM runs').fetchall()
+    assert len(runs) == 1
+    assert runs[0]['saved'] == time.mktime((2020, 1, 2, 3, 4, 5, 0, 0, -1))
+
+
+def test_fleet_last_runs_counts_fitted_runs_only(make_station, tmp_path):
+    database_file = str(tmp_path / "runs.db")
+    station = make_station()
+    station.dm.database_file = database_file
+    assert station.get_calibration()
+    # A verify only run afterwards is stored without coefficients
+    retest = make_station()
+    retest.dm.database_file = database_file
+    retest.clock.sleep(24 * 3600)
+    assert retest.quick_calibration()
+    with RD.run_database(database_file) as database:
+        stats = database.fleet_stats('volts', last_runs=1)
+    assert stats['runs'] == 1
+    assert stats['inverters'] == 3
+
+
+def test_dead_channel_coefficients_are_not_stored(make_station, tmp_path):
+    database_file = str(tmp_path / "runs.db")
+    station = make_station()
+    assert station.get_calibration()
+    # Inverter 2 never answered during the voltage sweep
+    station.dm.vstore.readings[:, 1] = float('nan')
+    voltage_fit, current_fit = station.fit_calibration()
+    assert voltage_fit.unfitted() == [1]
+    with RD.run_database(database_file) as database:
+        database.store_run(station.dm, time.time(), station.cloud.inverter_ids, voltage_fit, current_fit)
+        positions = [row[0] for row in database.connection.execute(
+            "SELECT position FROM coefficients WHERE sweep = 'volts' ORDER BY position")]
+    assert positions == [0, 2]
+
+
+def test_crashed_calibration_is_not_archived(make_station, tmp_path):
+    database_file = str(tmp_path / "runs.db")
+    station = make_station()
+    station.dm.database_file = database_file
+    # The cloud stops answering in the middle of the current sweep, after the voltage sweep was saved
+    call_function = station.pm.call_function
+
+    def crashing_call(name):
+        if name == station.pm.curr_call and station.calls.get(name, 0) >= 5:
+            raise PM.particle_error("bench lost power")
+        return call_function(name)
+
+    station.pm.call_function = crashing_call
+    assert not station.get_calibration()
+    with RD.run_database(database_file) as database:
+        assert database.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0] == 0
+
+
+def test_calibration_is_archived_once(make_station, tmp_path, monkeypatch):
+    database_file = str(tmp_path / "runs.db")
+    stored = []
+    store_run = RD.run_database.store_run
+
+    def counted_store_run(self, dm, *args, **kwargs):
+        stored.append(dm.get_run_dir())
+        return store_run(self, dm, *args, **kwargs)
+
+    monkeypatch.setattr(RD.run_database, 'store_run', counted_store_run)
+    station = make_station()
+    station.dm.database_file = database_file
+    assert station.get_calibration()
+    retest = make_station()
+    retest.dm.database_file = database_file
+    assert retest.quick_calibration()
+    assert stored == [station.dm.get_run_dir(), retest.dm.get_run_dir()]
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+import sample_stats as SS
+
+
+def test_outlier_is_rejected_per_channel():
+    samples = np.array([[1.00, 2.0], [1.01, 2.0], [0.99, 2.0], [1.00, 2.0], [5.00, 2.0]])
+    mean, spread, kept = SS.robust_aggregate(samples)
+    assert kept.tolist() == [4, 5]
+    assert mean == pytest.approx([1.0, 2.0])
+    assert spread[1] == 0.0
+
+
+def test_nan_samples_and_channels_are_ignored():
+    samples = np.array([[1.0, np.nan], [3.0, np.nan], [np.nan, np.nan]])
+    mean, spread, kept = SS.robust_aggregate(samples)
+    assert mean[0] == pytest.approx(2.0)
+    assert kept.tolist() == [2, 0]
+    assert np.isnan(mean[1]) and np.isnan(spread[1])
@@ -0,0 +1,38 @@
+import pytest
+
+import sweep_clock as SC
+import psu_simulator as PS
+
+
+def test_load_clamps_only_when_connected():
+    clock = SC.virtual_clock()
+    supply = PS.simulated_power_supply(clock)
+    supply.message('VOLT 10;:CURR 0.2;:OUTP ON')
+    clock.sleep(1.0)
+    # 0.2 A into 100/27 ohm is 0.74 V, the voltage sweep must not see that
+    assert supply.output_voltage() == pytest.approx(0.2 * 100.0 / 27.0, abs=1e-6)
+    supply.connect_load(False)
+    clock.sleep(1.0)
+    assert supply.output_voltage() == pytest.approx(10.0, abs=1e-6)
+
+
+def test_voltage_calibration_fits_simulated_inverters(make_station):
+    station = make_station()
+    assert station.get_calibration()
+    voltage_fit, current_fit = station.fit_calibration()
+    # reference = gain * measured + offset undoes the simulated inverter error
+    gains = [1.0 / gain for gain in station.cloud.gains]
+    assert voltage_fit.gain.tolist() == pytest.approx(gains, abs=0.005)
+    assert voltage_fit.max_error.max() < 0.01
+    assert current_fit.max_error.max() < 0.01
+
+
+def test_verification_passes_against_fresh_calibration(make_station):
+    station = make_station()
+    assert station.get_calibration()
+
+    retest = make_station()
+    assert retest.quick_calibration()
+    # Only the verification setpoints were measured, no full calibration
+    assert retest.calls[retest.pm.volt_call] == retest.verify_v_points
+    assert retest.calls[retest.pm.curr_call] == retest.verify_c_points
@@ -0,0 +1,56 @@
+import os
+import queue
+
+import sweep_clock as SC
+import calibration_station as CS
+import psu_simulator as PS
+import particle_simulator as PSIM
+import station_orchestrator as SO
+
+
+def simulated_station(config, station_dir):
+    # Module level so it can be sent to the worker processes
+    clock = SC.virtual_clock()
+    supply = PS.simulated_power_supply(clock)
+    cloud = PSIM.particle_simulator(supply, config.get('inverter_count', 3), config.get('seed', 0))
+    station = CS.calibration_station(name=config['name'], device_id=config['device_id'],
+                                     inverter_count=config.get('inverter_count', 3),
+                                     save_directory=station_dir, clock=clock)
+    station.kpsu.rm = PS.simulated_resource_manager(supply)
+    station.kpsu.load_switch = supply.connect_load
+    station.finish_delay = 0
+    station.pm.call_function = cloud.local_call
+    return station
+
+
+STATIONS = [
+    {"name": "rig1", "ip_address": "sim", "device_id": "sim1", "inverter_count": 2, "seed": 1},
+    {"name": "rig2", "ip_address": "sim", "device_id": "sim2", "inverter_count": 4, "seed": 2},
+]
+
+
+def test_run_station_logs_progress_and_saves(tmp_path):
+    progress = queue.Queue()
+    result = SO.run_station(STATIONS[0], str(tmp_path), progress, simulated_station)
+    assert result['success']
+    assert os.path.dirname(result['run_dir']) == str(tmp_path / "rig1")
+    assert os.path.exists(os.path.join(result['run_dir'], "metadata.json"))
+    with open(result['log_file']) as log:
+        assert "Starting station rig1" in log.read()
+    updates = []
+    while not progress.empty():
+        updates.append(progress.get())
+    assert ('rig1', 'volts') in {(name, sweep) for name, sweep, done, total in updates}
+
+
+def test_orchestrator_runs_every_station(tmp_path):
+    orchestrator = SO.station_orchestrator(STATIONS, str(tmp_path), station_factory=simulated_station)
+    results = orchestrator.run()
+    assert sorted(results) == ['rig1', 'rig2']
+    for name, result in results.items():
+        assert result['success'], result
+        assert os.path.dirname(result['run_dir']) == str(tmp_path / name)
+    # Every step of both sweeps was reported back from the workers
+    for sweeps in orchestrator.progress.values():
+        assert set(sweeps) == {'volts', 'current'}
+        assert all(done == total for done, total in sweeps.values())
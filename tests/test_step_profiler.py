@@ -0,0 +1,87 @@
+import csv
+import json
+import threading
+
+import pytest
+
+import sweep_clock as SC
+import step_profiler as SP
+
+
+def test_percentile_is_nearest_rank():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+    assert SP.percentile(values, 0.0) == 1.0
+    assert SP.percentile(values, 0.5) == 3.0
+    assert SP.percentile(values, 0.95) == 5.0
+    assert SP.percentile(values, 1.0) == 5.0
+    assert SP.percentile([], 0.5) == 0.0
+
+
+def test_spans_are_timed_on_the_clock():
+    clock = SC.virtual_clock()
+    profiler = SP.step_profiler(clock)
+    profiler.set_step('volts 1.0')
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        with profiler.span('settle'):
+            clock.sleep(seconds)
+    profiler.record('particle_http', clock.now(), 0.5, retries=2, detail='getVoltages')
+    summary = profiler.summary()
+    assert summary['settle']['count'] == 4
+    assert summary['settle']['total'] == pytest.approx(1.0)
+    assert summary['settle']['p50'] == pytest.approx(0.3)
+    assert summary['settle']['max'] == pytest.approx(0.4)
+    assert summary['particle_http']['retries'] == 2
+    assert {span['step'] for span in profiler.spans} == {'volts 1.0'}
+
+
+def test_span_is_recorded_when_the_step_fails():
+    profiler = SP.step_profiler(SC.virtual_clock())
+    with pytest.raises(IOError):
+        with profiler.span('scpi_query'):
+            raise IOError("timeout")
+    assert profiler.summary()['scpi_query']['count'] == 1
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = SP.step_profiler(SC.virtual_clock(), enabled=False)
+    with profiler.span('settle'):
+        pass
+    profiler.record('parse', 0.0, 1.0)
+    assert profiler.spans == [] and profiler.summary() == {}
+
+
+def test_step_label_is_per_thread():
+    profiler = SP.step_profiler(SC.virtual_clock())
+    profiler.set_step('volts 1.0')
+
+    def record():
+        profiler.set_step('volts 2.0')
+        profiler.record('data_append', 0.0, 0.1)
+
+    thread = threading.Thread(target=record)
+    thread.start()
+    thread.join()
+    profiler.record('settle', 0.0, 0.1)
+    assert [(span['step'], span['phase']) for span in profiler.spans] == [
+        ('volts 2.0', 'data_append'), ('volts 1.0', 'settle')]
+
+
+def test_export_json_and_csv(tmp_path):
+    profiler = SP.step_profiler(SC.virtual_clock())
+    profiler.set_step('current 0.5')
+    profiler.record('particle_http', 1.0, 0.25, retries=1, detail='getCurrents')
+    profiler.record('parse', 1.25, 0.001)
+
+    json_file = tmp_path / "profile.json"
+    profiler.to_json(str(json_file))
+    exported = json.loads(json_file.read_text())
+    assert exported['summary']['particle_http']['retries'] == 1
+    assert [span['phase'] for span in exported['spans']] == ['particle_http', 'parse']
+
+    csv_file = tmp_path / "profile.csv"
+    profiler.to_csv(str(csv_file))
+    with open(csv_file, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert rows[0] == {'step': 'current 0.5', 'phase': 'particle_http', 'start': '1.0', 'duration': '0.25',
+                       'retries': '1', 'detail': 'getCurrents'}
+    assert rows[1]['detail'] == ''
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+import sweep_engine as SE
+
+
+def logging_engine(log, record=None):
+    lock = threading.Lock()
+    state = {'setpoint': None}
+
+    def set_point(setpoint):
+        with lock:
+            log.append(('set', setpoint))
+        state['setpoint'] = setpoint
+
+    def fetch():
+        setpoint = state['setpoint']
+        # A slow cloud call, the psu must not change while it runs
+        time.sleep(0.01)
+        with lock:
+            log.append(('fetch', setpoint))
+        return [setpoint * 10]
+
+    def default_record(setpoint, readings):
+        with lock:
+            log.append(('record', setpoint, readings))
+
+    return SE.sweep_engine(set_point, fetch, record or default_record, name='test')
+
+
+def test_fetch_finishes_before_the_next_setpoint():
+    log = []
+    logging_engine(log).run([1, 2, 3, 4])
+    steps = [entry for entry in log if entry[0] != 'record']
+    assert steps == [('set', 1), ('fetch', 1), ('set', 2), ('fetch', 2),
+                     ('set', 3), ('fetch', 3), ('set', 4), ('fetch', 4)]
+
+
+def test_records_are_in_setpoint_order_with_their_readings():
+    log = []
+    logging_engine(log).run([1, 2, 3, 4])
+    records = [entry for entry in log if entry[0] == 'record']
+    assert records == [('record', setpoint, [setpoint * 10]) for setpoint in (1, 2, 3, 4)]
+
+
+def test_record_errors_stop_the_sweep():
+    log = []
+
+    def record(setpoint, readings):
+        if setpoint == 2:
+            raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        logging_engine(log, record).run(range(1, 20))
+    # The error surfaces within max_in_flight steps
+    assert len([entry for entry in log if entry[0] == 'set']) <= 2 + SE.sweep_engine.max_in_flight + 1
@@ -0,0 +1,29 @@
+import pytest
+
+import thermal_model as TM
+
+c_factor = 100.0 / 27.0
+
+
+def test_plan_never_exceeds_temp_limit():
+    thermal = TM.thermal_model(c_factor)
+    setpoints = [i * 0.5 for i in range(21)]
+    plan, total_dwell, peak_temp = thermal.schedule([s for s, dwell in thermal.plan_current_sweep(setpoints, 70)], 70)
+    assert sorted(s for s, dwell in plan) == setpoints
+    assert peak_temp <= thermal.temp_limit + 1e-9
+
+
+def test_required_dwell_cools_to_max_start_temp():
+    thermal = TM.thermal_model(c_factor)
+    thermal.reset(140.0)
+    dwell = thermal.required_dwell(10.0, 70)
+    assert dwell > 0
+    thermal.cool(dwell)
+    thermal.heat(10.0, 70)
+    assert thermal.temperature == pytest.approx(thermal.temp_limit)
+
+
+def test_step_too_hot_from_ambient_raises():
+    thermal = TM.thermal_model(c_factor)
+    with pytest.raises(ValueError):
+        thermal.max_start_temp(1000.0, 10 * thermal.time_constant)
@@ -0,0 +1,71 @@
+import pytest
+
+import sweep_clock as SC
+import kpsu_controller as KPSU
+import psu_simulator as PS
+import waveform as WF
+
+
+def recording_generator(latency):
+    # Waveform generator on a simulated psu, records (time, voltage) of every applied setpoint
+    clock = SC.virtual_clock()
+    supply = PS.simulated_power_supply(clock)
+    supply.latency = latency
+    kpsu = KPSU.kn57psu_controller(clock)
+    kpsu.rm = PS.simulated_resource_manager(supply)
+    kpsu.load_switch = supply.connect_load
+    applied = []
+    apply_voltage = kpsu.apply_voltage
+
+    def recording_apply(voltage_setpoint):
+        applied.append((clock.now(), voltage_setpoint))
+        apply_voltage(voltage_setpoint)
+
+    kpsu.apply_voltage = recording_apply
+    return WF.waveform_generator(kpsu, clock), applied
+
+
+def test_waveform_points():
+    assert WF.waveform_points('triangle', 0.0, 10.0, 1.0, 4) == [0.0, 5.0, 10.0, 5.0]
+    assert WF.waveform_points('step', 1.0, 2.0, 1.0, 4) == [2.0, 2.0, 1.0, 1.0]
+    with pytest.raises(ValueError):
+        WF.waveform_points('saw', 0.0, 1.0, 1.0, 4)
+
+
+def test_setpoints_follow_the_deadlines():
+    generator, applied = recording_generator(0.0)
+    stats = generator.run('triangle', 0.0, 10.0, 1.0, 10, 0.1, cycles=2)
+    points = WF.waveform_points('triangle', 0.0, 10.0, 1.0, 10)
+    assert stats['steps'] == 20 and stats['missed'] == 0
+    assert [voltage for time, voltage in applied] == points * 2
+    start = applied[0][0]
+    assert [time - start for time, voltage in applied] == pytest.approx([i * 0.1 for i in range(20)])
+    assert stats['jitter_max'] == pytest.approx(0.0, abs=1e-9)
+    assert stats['elapsed'] == pytest.approx(stats['expected'])
+
+
+@pytest.mark.parametrize('latency', [0.13, 0.25, 0.45])
+def test_slow_supply_skips_missed_deadlines(latency):
+    # Every write takes longer than the interval, the generator falls behind and has to skip
+    generator, applied = recording_generator(latency)
+    stats = generator.run('sine', 0.0, 10.0, 1.0, 10, 0.1, cycles=3)
+    points = WF.waveform_points('sine', 0.0, 10.0, 1.0, 10)
+    interval = 0.1
+    assert stats['missed'] > 0
+    assert stats['steps'] + stats['missed'] == 30
+    assert 0 < stats['jitter_mean'] <= stats['jitter_p95'] <= stats['jitter_max']
+    # Nothing is applied later than miss_fraction of an interval after its deadline
+    assert stats['jitter_max'] <= generator.miss_fraction * interval
+    # A late setpoint is still the one for its own deadline, the period does not drift
+    start = applied[0][0]
+    for time, voltage in applied:
+        step = int((time - start) / interval + 1e-9)
+        assert voltage == points[step % len(points)]
+
+
+def test_duration_bounds_the_run():
+    generator, applied = recording_generator(0.0)
+    stats = generator.run('step', 0.0, 5.0, 2.0, 8, 0.1, duration=1.0)
+    assert stats['steps'] == 4 * 2
+    with pytest.raises(ValueError):
+        generator.run('step', 0.0, 5.0, 2.0, 8, 0.1)
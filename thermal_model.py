@@ -0,0 +1,136 @@
+# Import other libraries
+import math
+
+'''
+thermal model class
+Functionality:
+1) First order thermal model of the load resistor used for the current sweep
+2) Computes the minimal cooldown (psu at 0 V) needed before each current step so the
+   modeled resistor temperature never goes over temp_limit
+3) Reorders the current setpoints so low power steps overlap the cooldown of high power steps
+'''
+
+class thermal_model:
+    # config values
+    # Hottest resistor of the parallel network, the 4 ohm resistor takes V^2/4
+    resistance = 4.0
+    ambient_temp = 25.0
+    # Degrees C per watt at steady state
+    thermal_resistance = 0.5
+    # Seconds for the resistor to reach 63% of its steady state temperature
+    time_constant = 120.0
+    temp_limit = 150.0
+
+    def __init__(self, c_factor):
+        # Conversion factor from current setpoint to psu voltage, see kn57psu_controller.c_factor
+        self.c_factor = c_factor
+        self.temperature = self.ambient_temp
+
+    def reset(self, temperature=None):
+        self.temperature = self.ambient_temp if temperature is None else temperature
+
+    def step_power(self, current_setpoint):
+        # Power dissipated in the resistor for a current sweep setpoint
+        V = self.c_factor * current_setpoint
+        return V * V / self.resistance
+
+    def voltage_step_power(self, voltage_setpoint, current_limit):
+        # Power for a voltage sweep setpoint, the psu current limit caps the load voltage
+        V = min(voltage_setpoint, current_limit * self.c_factor)
+        return V * V / self.resistance
+
+    def steady_temp(self, power):
+        return self.ambient_temp + power * self.thermal_resistance
+
+    def temperature_after(self, start_temp, power, duration):
+        # T(t) = T_ss + (T_0 - T_ss) * e^(-t / tau)
+        T_ss = self.steady_temp(power)
+        return T_ss + (start_temp - T_ss) * math.exp(-duration / self.time_constant)
+
+    def max_start_temp(self, power, duration):
+        # Highest temperature a step can start at and still end under temp_limit
+        T_ss = self.steady_temp(power)
+        if T_ss <= self.temp_limit:
+            return self.temp_limit
+        max_temp = T_ss - (T_ss - self.temp_limit) * math.exp(duration / self.time_constant)
+        if max_temp < self.ambient_temp:
+            raise ValueError(f"Step of {power:.1f} W for {duration} s exceeds {self.temp_limit} C even from ambient")
+        return max_temp
+
+    def cooldown_time(self, start_temp, target_temp):
+        # Seconds at 0 W to cool from start_temp down to target_temp
+        if start_temp <= target_temp:
+            return 0.0
+        return self.time_constant * math.log((start_temp - self.ambient_temp) / (target_temp - self.ambient_temp))
+
+    def required_dwell(self, current_setpoint, duration, start_temp=None):
+        # Minimal safe dwell before a step of the given duration
+        if start_temp is None:
+            start_temp = self.temperature
+        max_temp = self.max_start_temp(self.step_power(current_setpoint), duration)
+        return self.cooldown_time(start_temp, max_temp)
+
+    def cool(self, duration):
+        self.temperature = self.temperature_after(self.temperature, 0.0, duration)
+
+    def heat(self, current_setpoint, duration):
+        self.temperature = self.temperature_after(self.temperature, self.step_power(current_setpoint), duration)
+
+    def dissipate(self, power, duration):
+        self.temperature = self.temperature_after(self.temperature, power, duration)
+
+    def schedule(self, setpoints, duration, start_temp=None):
+        # Simulate an ordering, returns [(setpoint, dwell)], total dwell and peak temperature
+        temperature = self.temperature if start_temp is None else start_temp
+        plan = []
+        total_dwell = 0.0
+        peak_temp = temperature
+        for setpoint in setpoints:
+            dwell = self.required_dwell(setpoint, duration, temperature)
+            temperature = self.temperature_after(temperature, 0.0, dwell)
+            temperature = self.temperature_after(temperature, self.step_power(setpoint), duration)
+            peak_temp = max(peak_temp, temperature)
+            total_dwell += dwell
+            plan.append((setpoint, dwell))
+        return plan, total_dwell, peak_temp
+
+    def greedy_order(self, setpoints, duration):
+        # Always run the hottest step that needs no cooldown, otherwise the coolest step left
+        remaining = sorted(setpoints)
+        order = []
+        temperature = self.temperature
+        while remaining:
+            ready = [s for s in remaining if self.required_dwell(s, duration, temperature) == 0.0]
+            setpoint = ready[-1] if ready else remaining[0]
+            dwell = self.required_dwell(setpoint, duration, temperature)
+            temperature = self.temperature_after(temperature, 0.0, dwell)
+            temperature = self.temperature_after(temperature, self.step_power(setpoint), duration)
+            remaining.remove(setpoint)
+            order.append(setpoint)
+        return order
+
+    def interleaved_order(self, setpoints):
+        # high, low, next high, next low ...
+        ordered = sorted(setpoints)
+        order = []
+        while ordered:
+            order.append(ordered.pop())
+            if ordered:
+                order.append(ordered.pop(0))
+        return order
+
+    def plan_current_sweep(self, setpoints, duration):
+        # Pick the ordering with the least total cooldown, then the lowest peak temperature
+        candidates = [
+            sorted(setpoints),
+            self.interleaved_order(setpoints),
+            self.greedy_order(setpoints, duration),
+        ]
+        best = None
+        for order in candidates:
+            plan, total_dwell, peak_temp = self.schedule(order, duration)
+            if best is None or (total_dwell, peak_temp) < best[1:]:
+                best = (plan, total_dwell, peak_temp)
+        plan, total_dwell, peak_temp = best
+        print(f"Current sweep plan: {len(plan)} steps, total cooldown {total_dwell:.1f} s, peak {peak_temp:.1f} C")
+        return plan
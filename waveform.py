@@ -0,0 +1,91 @@
+# Import other libraries
+import math
+
+import sweep_clock as SC
+import step_profiler as SP
+
+'''
+waveform generator class
+Functionality:
+1) Precomputes one period of setpoints for a triangle, sine or step waveform
+2) Issues the setpoints on absolute deadlines (start + i * interval) over one psu session, so
+   a slow step never shifts the ones after it and the period does not drift
+3) Reports the lateness (jitter) of every setpoint and the deadlines it had to skip
+4) Always bounded by a cycle count or a duration
+'''
+
+def waveform_points(shape, low, high, frequency, sample_rate):
+    # One period starting at low, sample_rate setpoints per second
+    count = max(2, int(round(sample_rate / frequency)))
+    points = []
+    for i in range(count):
+        phase = i / count
+        if shape == 'triangle':
+            level = 2.0 * phase if phase < 0.5 else 2.0 - 2.0 * phase
+        elif shape == 'sine':
+            level = 0.5 - 0.5 * math.cos(2.0 * math.pi * phase)
+        elif shape == 'step':
+            level = 1.0 if phase < 0.5 else 0.0
+        else:
+            raise ValueError(f"Unknown waveform shape: {shape}")
+        points.append(round(low + (high - low) * level, 3))
+    return points
+
+
+class waveform_generator:
+    # config values
+    # A setpoint later than this fraction of the interval is skipped and counted as missed
+    miss_fraction = 0.5
+
+    def __init__(self, kpsu, clock=None):
+        self.kpsu = kpsu
+        self.clock = clock if clock is not None else SC.system_clock()
+
+    def run(self, shape, low, high, frequency, sample_rate, current_setpoint, cycles=None, duration=None):
+        if cycles is None and duration is None:
+            raise ValueError("Waveform needs a cycle count or a duration")
+        points = waveform_points(shape, low, high, frequency, sample_rate)
+        # Interval from the rounded point count so a period is exactly 1 / frequency
+        interval = 1.0 / (frequency * len(points))
+        steps = len(points) * cycles if cycles is not None else int(math.ceil(duration / interval))
+        lateness = []
+        missed = 0
+
+        print(f"Waveform {shape} {low}-{high} V at {frequency} Hz, {len(points)} points per period, {steps} steps")
+        with self.kpsu:
+            self.kpsu.program_setpoint(points[0], current_setpoint)
+            start = self.clock.now()
+            step = 0
+            while step < steps:
+                deadline = start + step * interval
+                wait = deadline - self.clock.now()
+                if wait > 0:
+                    self.clock.sleep(wait)
+                late = self.clock.now() - deadline
+                if late > self.miss_fraction * interval:
+                    # Jump to the next deadline that can still be met instead of playing catch up
+                    skipped = max(1, int(late // interval))
+                    missed += skipped
+                    step += skipped
+                    continue
+                self.kpsu.apply_voltage(points[step % len(points)])
+                lateness.append(late)
+                step += 1
+            # Hold the last setpoint for its full interval so every cycle is a complete period
+            self.clock.sleep(start + steps * interval - self.clock.now())
+            elapsed = self.clock.now() - start
+
+        stats = {
+            'steps': len(lateness),
+            'missed': missed,
+            'elapsed': elapsed,
+            'expected': steps * interval,
+            'jitter_mean': sum(lateness) / len(lateness) if lateness else 0.0,
+            'jitter_p95': SP.percentile(lateness, 0.95),
+            'jitter_max': max(lateness) if lateness else 0.0,
+        }
+        print(f"Waveform done: {stats['steps']} setpoints, {missed} missed deadlines, "
+              f"{elapsed:.3f} s (expected {stats['expected']:.3f} s)")
+        print(f"Jitter mean {stats['jitter_mean'] * 1000:.2f} ms, p95 {stats['jitter_p95'] * 1000:.2f} ms, "
+              f"max {stats['jitter_max'] * 1000:.2f} ms")
+        return stats